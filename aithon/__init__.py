@@ -1 +1 @@
-from aithon.aithon import convert_aithon, convert_file, convert_directory, revert_aithon, revert_file, main
+from aithon.aithon import analyze, Marker, MarkedResult, Stats, apply_edit, edit_file, convert_aithon, convert_file, convert_stream, check_file, iter_check, verify_source, verify_file, iter_verify, iter_batch, convert_directory, convert_mapping, iter_convert, revert_aithon, revert_file, revert_stream, revert_directory, revert_mapping, iter_revert, walk_py_files, git_changed, iter_changed, watch_directory, index_directory, query_index, serve, main
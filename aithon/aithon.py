@@ -1,11 +1,50 @@
 """aithon: AI + python. Injects #/<line> markers for AI-assisted editing."""
 
 import ast
+import fnmatch
+import hashlib
+import heapq
+import inspect
+import io
+import json
+import mmap
 import os
-from pathlib import Path
+import re
+import stat
+import subprocess
+import sys
+import time
+import tokenize
+from collections import namedtuple
+from pathlib import Path, PurePosixPath
 import argparse
 
 
+CACHE_FILE = '.aithon-cache.json'
+INDEX_FILE = '.aithon-index.sqlite'
+# directories never descended into, whatever --exclude and .gitignore say
+SKIP_DIRS = frozenset(('.git', '.hg', '.svn', '__pycache__', '.tox', '.nox', '.venv',
+                       'node_modules', 'site-packages'))
+ENGINES = ('auto', 'ast', 'tokenize')
+# sources larger than this (in characters) use the tokenize engine under 'auto'
+TOKENIZE_THRESHOLD = 1 << 20
+# files larger than this (in bytes) are restored from an mmap, in slices
+STREAM_THRESHOLD = 16 << 20
+# a line holding only a #/<line> marker, plus its newline; the lookahead
+# lets most line starts fail before the full pattern is tried
+_MARKER_LINE = re.compile(r'^(?=[^\S\n]*#/)[^\S\n]*#/\d*[^\S\n]*\n', re.MULTILINE)
+_MARKER_ONLY = re.compile(r'[^\S\n]*#/\d*[^\S\n]*')
+# the same two patterns for undecoded bytes; [^\S\n] also eats the \r of CRLF
+_MARKER_LINE_BYTES = re.compile(rb'^(?=[^\S\n]*#/)[^\S\n]*#/\d*[^\S\n]*\n', re.MULTILINE)
+_MARKER_ONLY_BYTES = re.compile(rb'[^\S\n]*#/\d*[^\S\n]*')
+# a line ending as Python's tokenizer sees it, and a \r that ends a line on its own
+_NEWLINE = re.compile(r'\r\n|\r|\n')
+_NEWLINE_BYTES = re.compile(rb'\r\n|\r|\n')
+_LONE_CR = re.compile(r'\r(?!\n)')
+_LONE_CR_BYTES = re.compile(rb'\r(?!\n)')
+_MARKER_TAIL = re.compile(r'#/(\d*)[^\S\n]*$', re.MULTILINE)
+
+
 HELP = """
 aithon: AI + python. Injects #/<line> markers into Python code for AI-assisted editing.
 
@@ -63,63 +102,187 @@ AFTER:
 
 USAGE:
   aithon --source <file> --target <file>
+  aithon - [--action restore] < <file> > <file>
   aithon --srcdir <dir> --tgtdir <dir> [--action replica|replace|restore]
+  aithon watch --srcdir <dir> --tgtdir <dir> [--action replica|replace]
+  aithon serve [--socket <path>]
+  aithon index --srcdir <dir> [--db <file>]
+  aithon query --srcdir <dir> --source <relative path> [--marker N]
+  aithon edit --source <marked file> --marker N --replacement <file|-> [--target <file>]
+  aithon verify --srcdir <dir> | --source <file>
+  aithon batch [--source <requests.jsonl>] [--target <responses.jsonl>]
 
 FLAGS:
-  --source        Input file
-  --target        Output file
+  --source        Input file ('-' = stdin)
+  --target        Output file ('-' = stdout; the default with --source -)
   --srcdir        Input directory
   --tgtdir        Output directory
   --action        replica (create _ai files), replace (overwrite existing files), or restore (remove markers)
   --dryrun       Show what would be converted
+  --jobs          Worker processes for directory runs (default: CPU count)
+  --engine        Block finder: ast, tokenize (streaming, for huge files), or auto
+                  (tokenize above 1 MiB; it only checks block structure, so other
+                  syntax errors there get AST-style markers, not heuristic ones)
+  --cache         Skip files unchanged since the last run (manifest in --tgtdir)
+  --cache-dir     Keep the --cache manifest in this directory instead
+  --stats [N]     Print time per phase (walk, read, strip, parse, terminators,
+                  join, write), files/sec, bytes/sec and the N slowest files
+  --exclude GLOB  Skip files/directories matching GLOB (repeatable); .git, .venv,
+                  node_modules, site-packages and __pycache__ are always skipped
+  --no-gitignore  Also walk paths listed in .gitignore files
+  --max-file-size Skip .py files larger than this many bytes
+  --since REF     Directory runs: only .py files changed since git REF
+  --staged        Directory runs: only staged .py files, content taken from the git index
+  --check         Verify targets are up to date without writing; list stale ones, exit 1 if any
+  --report PATH   One JSON record per converted file: path, output, bytes, lines,
+                  markers, engine, SyntaxError location, seconds ('-' = JSON Lines on stdout)
 
 EXAMPLES:
   aithon --source app.py --target app_ai.py
   aithon --srcdir src/ --tgtdir ai/
   aithon --srcdir src/ --tgtdir src/ --action replace
+  aithon --srcdir src/ --tgtdir ai/ --jobs 8
+  aithon --srcdir src/ --tgtdir ai/ --cache
+  aithon --srcdir src/ --tgtdir ai/ --stats 5
+  aithon --srcdir src/ --tgtdir ai/ --report run.json
+  aithon --srcdir src/ --tgtdir ai/ --check
+  aithon --srcdir . --tgtdir ai/ --since origin/main
+  aithon --srcdir . --tgtdir ai/ --staged
+  aithon --srcdir . --tgtdir ai/ --exclude 'tests/*' --exclude '*_pb2.py' --max-file-size 1000000
+  aithon watch --srcdir src/ --tgtdir ai/
+  aithon index --srcdir src/
+  aithon query --srcdir src/ --source services/billing.py --marker 512
+  aithon edit --source app_ai.py --marker 5 --replacement new_block.py
+  aithon verify --srcdir src/ --jobs 8
+  echo '{"id": 1, "source": "if x:\\n    y\\n"}' | aithon batch --jobs 1
+  aithon batch --source requests.jsonl --target responses.jsonl
+  echo '{"jsonrpc": "2.0", "id": 1, "method": "convert_aithon", "params": ["if x:\\n    y\\n"]}' | aithon serve
   aithon --action restore --source app_ai.py --target app.py
+  git show HEAD:app.py | aithon - | llm "add logging after #/5"
+  llm < prompt.txt | aithon - --action restore > app.py
   aithon --action restore --srcdir ai/ --tgtdir clean/
 """
 
 
+# Statement lists that can end a block, per compound statement type.
+# 'handlers' and 'cases' hold clauses whose own .body ends a block.
+_BLOCK_FIELDS = {
+    ast.FunctionDef: ('body',),
+    ast.AsyncFunctionDef: ('body',),
+    ast.ClassDef: ('body',),
+    ast.If: ('body', 'orelse'),
+    ast.For: ('body', 'orelse'),
+    ast.AsyncFor: ('body', 'orelse'),
+    ast.While: ('body', 'orelse'),
+    ast.With: ('body',),
+    ast.AsyncWith: ('body',),
+    ast.Try: ('body', 'handlers', 'orelse', 'finalbody'),
+}
+if hasattr(ast, 'TryStar'):
+    _BLOCK_FIELDS[ast.TryStar] = _BLOCK_FIELDS[ast.Try]
+if hasattr(ast, 'Match'):
+    _BLOCK_FIELDS[ast.Match] = ('cases',)
+_SCOPES = frozenset((ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+
+
+def _qualname(scope, local, name):
+    """__qualname__-style name for name defined in scope."""
+    if not scope:
+        return name
+    return f"{scope}.<locals>.{name}" if local else f"{scope}.{name}"
+
+
+def _ast_blocks(tree, source_lines=None):
+    """Map each block-end line to (kind, start, depth, qualname) of the outermost block ending there.
+
+    Only statement lists are visited; expressions can't close a block.
+    A compound statement written on a single line gets no markers.
+    depth is the indentation level of the closed body (module = 0); an
+    elif chain is reported as the if statement it belongs to. qualname
+    names the def/class itself, or the scope the statement sits in
+    ('' at module level). source_lines (the parsed source split on '\n')
+    places a case whose pattern starts below the case keyword; without
+    it such a case starts on the first line after the previous case.
+    """
+    blocks = {}
+    # (node, depth, inherited info, enclosing qualname, enclosing scope is a function)
+    stack = [(node, 1, None, '', False) for node in tree.body]
+    # parents are popped before their children, so setdefault keeps the outermost
+    while stack:
+        node, depth, info, scope, local = stack.pop()
+        fields = _BLOCK_FIELDS.get(type(node))
+        if fields is None:
+            continue
+        multiline = node.lineno != node.end_lineno
+        if type(node) in _SCOPES:
+            name = _qualname(scope, local, node.name)
+            inner = (name, type(node) is not ast.ClassDef)
+        else:
+            name = scope
+            inner = (scope, local)
+        if info is None:
+            info = (type(node).__name__, node.lineno, depth, name)
+        orelse = getattr(node, 'orelse', None)
+        if (type(node) is ast.If and len(orelse) == 1 and type(orelse[0]) is ast.If
+                and orelse[0].col_offset == node.col_offset):
+            # elif: same statement, same depth
+            if multiline:
+                blocks.setdefault(orelse[0].end_lineno, info)
+            stack.append((orelse[0], depth, info, scope, local))
+            fields = ('body',)
+        for field in fields:
+            if field == 'cases':
+                # match_case has no lineno of its own and is always marked
+                after = node.subject.end_lineno
+                for case in node.cases:
+                    start = _case_line(case, after + 1, source_lines)
+                    after = case.body[-1].end_lineno
+                    blocks.setdefault(after, ('match_case', start, depth + 1, scope))
+                    stack.extend((child, depth + 2, None) + inner for child in case.body)
+                continue
+            if field == 'handlers':
+                bodies = [handler.body for handler in node.handlers]
+            else:
+                bodies = [getattr(node, field)]
+            for body in bodies:
+                if body:
+                    if multiline:
+                        blocks.setdefault(body[-1].end_lineno, info)
+                    stack.extend((child, depth + 1, None) + inner for child in body)
+    
+    if tree.body:
+        blocks.setdefault(tree.body[-1].end_lineno, ('Module', 1, 0, ''))
+    return blocks
+
+
+def _case_line(case, first, source_lines):
+    """Line of the case keyword, first being the line after the previous case or subject.
+
+    Only blank and comment lines can sit between first and the keyword.
+    The pattern's own line is not enough: a parenthesized pattern may
+    start lines below the keyword.
+    """
+    line = case.pattern.lineno
+    if line == first:
+        return line
+    if source_lines is None:
+        return first
+    for i in range(first, line):
+        text = source_lines[i - 1].lstrip()
+        if text and not text.startswith('#'):
+            return i
+    return line
+
+
 def get_terminators_ast(tree, source_lines):
     """Find line numbers where blocks END using AST."""
-    block_markers = {}
-    
-    def process_node(node):
-        if hasattr(node, 'lineno') and hasattr(node, 'end_lineno'):
-            if node.lineno == node.end_lineno:
-                return
-        
-        if hasattr(node, 'body') and node.body:
-            last_stmt = node.body[-1]
-            if hasattr(last_stmt, 'end_lineno'):
-                block_markers[last_stmt.end_lineno] = last_stmt.end_lineno
-        
-        if hasattr(node, 'handlers') and node.handlers:
-            for handler in node.handlers:
-                if handler.body and handler.body[-1]:
-                    if hasattr(handler.body[-1], 'end_lineno'):
-                        block_markers[handler.body[-1].end_lineno] = handler.body[-1].end_lineno
-        
-        if hasattr(node, 'orelse') and node.orelse:
-            if node.orelse[-1] and hasattr(node.orelse[-1], 'end_lineno'):
-                block_markers[node.orelse[-1].end_lineno] = node.orelse[-1].end_lineno
-        
-        if hasattr(node, 'finalbody') and node.finalbody:
-            if node.finalbody[-1] and hasattr(node.finalbody[-1], 'end_lineno'):
-                block_markers[node.finalbody[-1].end_lineno] = node.finalbody[-1].end_lineno
-    
-    for node in ast.walk(tree):
-        process_node(node)
-    
-    return block_markers
+    return {line: line for line in _ast_blocks(tree, source_lines)}
 
 
-def get_terminators_heuristic(source_code):
-    """Heuristic for broken Python - find block starts."""
+def _heuristic_blocks(source_code):
+    """Map each block-start line to (keyword, line, None, None) for broken Python."""
     lines = source_code.split('\n')
-    block_markers = {}
+    blocks = {}
     
     block_starts = {'def', 'class', 'if', 'elif', 'else', 'for', 'while', 'try', 
                     'except', 'finally', 'with', 'match', 'case', 'async'}
@@ -137,136 +300,2274 @@ def get_terminators_heuristic(source_code):
                 first_word = 'async ' + second_word
         
         if first_word in block_starts or stripped.startswith(('async ',)):
-            block_markers[i] = i
+            blocks[i] = (first_word, i, None, None)
     
-    return block_markers
+    return blocks
 
 
-def convert_aithon(source_code):
-    """Convert Python to Aithon format."""
-    import re
-    
-    lines = source_code.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        stripped = line.strip()
-        if stripped == '#/' or re.match(r'^#/\d+$', stripped):
-            continue
-        if re.match(r'^#/\d*\s*$', line):
-            continue
-        cleaned_lines.append(line)
+def get_terminators_heuristic(source_code):
+    """Heuristic for broken Python - find block starts."""
+    return {line: line for line in _heuristic_blocks(source_code)}
+
+
+_HARD_COMPOUND = frozenset(('if', 'for', 'while', 'try', 'with', 'def', 'class', 'async'))
+_CONTINUATIONS = frozenset(('elif', 'else', 'except', 'finally'))
+_OPEN_BRACKETS = frozenset('([{')
+_CLOSE_BRACKETS = frozenset(')]}')
+# statement keyword -> ast node name, so both engines report the same kinds
+_KIND_NAMES = {
+    'if': 'If', 'for': 'For', 'while': 'While', 'try': 'Try', 'with': 'With',
+    'def': 'FunctionDef', 'class': 'ClassDef', 'match': 'Match', 'case': 'match_case',
+    'try*': 'TryStar',
+    'async def': 'AsyncFunctionDef', 'async for': 'AsyncFor', 'async with': 'AsyncWith',
+}
+
+
+def _tokenize_blocks(source_code):
+    """Same result as _ast_blocks, read from the token stream.
+
+    Walks tokenize's INDENT/DEDENT stream and keeps one open statement per
+    indentation level, so memory does not grow with file length. Only block
+    structure is validated (SyntaxError on bad indentation, a missing header
+    colon or a stray clause); other syntax errors go unnoticed.
+    """
+    blocks = {}
+    # one entry per indentation level: the compound statement that may still
+    # take clauses, as [start_row, pending_end_row, multiline, keyword, info,
+    # body qualname, body is function-local]
+    levels = [None]
+    expect_indent = False
+    last_row = 0
+    first = second = third = None
+    start_row = depth = lambdas = 0
+    colon = trailing = False
+
+    def close_clause(stmt, row):
+        # a compound statement on a single line gets no markers, unless it
+        # is a case clause (match_case has no lineno in the ast); a match
+        # statement ends where its last case does, which is already marked
+        keyword = stmt[3]
+        if keyword == 'match':
+            return
+        if stmt[2] or row != stmt[0] or keyword == 'case':
+            stmt[2] = True
+            # inner blocks close first, so overwriting keeps the outermost
+            blocks[row] = stmt[4]
+            if stmt[1]:
+                blocks[stmt[1]] = stmt[4]
+                stmt[1] = None
+        else:
+            stmt[1] = row
+
+    readline = io.StringIO(source_code).readline
+    try:
+        for tok in tokenize.generate_tokens(readline):
+            kind = tok.type
+            if kind in (tokenize.COMMENT, tokenize.NL):
+                continue
+            if kind == tokenize.INDENT:
+                if not expect_indent:
+                    raise SyntaxError('unexpected indent', ('<aithon>', tok.start[0], 1, tok.line))
+                expect_indent = False
+                levels.append(None)
+                continue
+            if expect_indent:
+                raise SyntaxError('expected an indented block', ('<aithon>', tok.start[0], 1, tok.line))
+            if kind == tokenize.DEDENT:
+                levels.pop()
+                close_clause(levels[-1], last_row)
+                continue
+            if kind == tokenize.ENDMARKER:
+                break
+            if kind != tokenize.NEWLINE:
+                if first is None:
+                    first = tok.string if kind == tokenize.NAME else ''
+                    start_row = tok.start[0]
+                elif second is None:
+                    second = tok.string
+                elif third is None:
+                    third = tok.string
+                if colon:
+                    trailing = True
+                elif kind == tokenize.OP and tok.string in _OPEN_BRACKETS:
+                    depth += 1
+                elif kind == tokenize.OP and tok.string in _CLOSE_BRACKETS:
+                    depth -= 1
+                elif depth == 0 and tok.string == 'lambda':
+                    lambdas += 1
+                elif depth == 0 and tok.string == ':' and kind == tokenize.OP:
+                    if lambdas:
+                        lambdas -= 1
+                    else:
+                        colon = True
+                continue
+
+            # NEWLINE: one logical line from start_row to here
+            prev_row, last_row = last_row, tok.start[0]
+            owner = levels[-2] if len(levels) > 1 else None
+            if first in _CONTINUATIONS:
+                stmt = levels[-1]
+                if stmt is None or not colon:
+                    raise SyntaxError('invalid syntax', ('<aithon>', start_row, 1, ''))
+                stmt[2] = True
+                if first == 'except' and second == '*' and stmt[3] == 'try':
+                    # only now is it known to be try/except*; relabel the try body
+                    stmt[3] = 'try*'
+                    stmt[4] = (_KIND_NAMES['try*'],) + stmt[4][1:]
+                    blocks[prev_row] = stmt[4]
+                if stmt[1]:
+                    blocks[stmt[1]] = stmt[4]
+                    stmt[1] = None
+            elif (first in _HARD_COMPOUND
+                  or (first == 'match' and colon and not trailing and second != ':')
+                  or (first == 'case' and colon and owner is not None and owner[3] == 'match')):
+                if not colon:
+                    raise SyntaxError('expected ":"', ('<aithon>', start_row, 1, ''))
+                keyword = f'async {second}' if first == 'async' else first
+                if keyword not in _KIND_NAMES:
+                    raise SyntaxError('invalid syntax', ('<aithon>', start_row, 1, ''))
+                scope, local = (owner[5], owner[6]) if owner else ('', False)
+                if keyword in ('def', 'class', 'async def'):
+                    scope = _qualname(scope, local, third if first == 'async' else second)
+                    local = keyword != 'class'
+                    name = scope
+                else:
+                    name = owner[5] if owner else ''
+                info = (_KIND_NAMES[keyword], start_row, len(levels), name)
+                stmt = levels[-1] = [start_row, None, False, keyword, info, scope, local]
+            else:
+                levels[-1] = None
+                stmt = None
+            if stmt is not None:
+                if trailing:
+                    close_clause(stmt, last_row)
+                else:
+                    expect_indent = True
+            first = second = third = None
+            depth = lambdas = 0
+            colon = trailing = False
+    except tokenize.TokenError as e:
+        msg, (row, col) = e.args
+        raise SyntaxError(msg, ('<aithon>', row, col, ''))
+
+    if last_row:
+        blocks.setdefault(last_row, ('Module', 1, 0, ''))
+    return blocks
+
+
+def get_terminators_tokenize(source_code):
+    """Find the same block ends as get_terminators_ast from the token stream."""
+    return {line: line for line in _tokenize_blocks(source_code)}
+
+
+Marker = namedtuple('Marker', 'line output_line kind start depth qualname')
+Marker.__doc__ = """One #/<line> marker.
+
+line is the number in the marker (block end, or block start for the
+heuristic), output_line is where the marker sits in the marked text, kind
+the ast node name (keyword for the heuristic) of the outermost block
+closing there, start its first line, depth its nesting level and
+qualname the def/class it is or sits in (depth and qualname are None
+for the heuristic).
+"""
+MarkedResult = namedtuple('MarkedResult', 'text markers engine error', defaults=(None,))
+MarkedResult.__doc__ = """analyze() result: marked text, list of Marker, engine used.
+
+error is the SyntaxError that sent the source to the heuristic, else None.
+"""
+
+
+def _lap(timings, phase, start):
+    """Add the time since start to timings[phase]; return the current time."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + now - start
+    return now
+
+
+def analyze(source_code, engine='auto', timings=None):
+    """Mark source_code and describe every marker in the same pass.
+
+    Returns MarkedResult(text, markers, engine, error) where text equals
+    convert_aithon(source_code, engine) and engine is the one that ran:
+    'ast', 'tokenize' or 'heuristic'. If timings is a dict, seconds spent
+    in the strip, parse, terminators and join phases are added to it
+    (the tokenize engine parses and finds block ends in one pass, counted
+    as terminators).
+    """
+    return _analyze(source_code, engine, timings)[0]
+
+
+def _analyze(source_code, engine='auto', timings=None):
+    """analyze(), also returning the module's ast when the ast engine built one (else None)."""
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine: {engine!r}")
     
-    source_code = '\n'.join(cleaned_lines)
+    start = time.perf_counter()
+    source_code = _strip_markers(source_code)
     source_lines = source_code.split('\n')
+    start = _lap(timings, 'strip', start)
+    
+    if engine == 'auto':
+        engine = 'tokenize' if len(source_code) > TOKENIZE_THRESHOLD else 'ast'
     
+    markers = []
+    new_lines = []
+    error = None
+    tree = None
     try:
-        tree = ast.parse(source_code)
-        markers = get_terminators_ast(tree, source_lines)
-        new_lines = []
+        if engine == 'tokenize':
+            blocks = _tokenize_blocks(source_code)
+        else:
+            try:
+                tree = ast.parse(source_code)
+            except UnicodeEncodeError as e:
+                # undecodable bytes kept as surrogates; CPython rejects the file too
+                raise SyntaxError(f"invalid {e.encoding} byte in source",
+                                  ('<aithon>', source_code.count('\n', 0, e.start) + 1,
+                                   e.start - source_code.rfind('\n', 0, e.start), ''))
+            start = _lap(timings, 'parse', start)
+            blocks = _ast_blocks(tree, source_lines)
+        start = _lap(timings, 'terminators', start)
         for i, line in enumerate(source_lines, 1):
             new_lines.append(line)
-            if i in markers:
-                new_lines.append(f'#/{markers[i]}')
-    except SyntaxError:
-        markers = get_terminators_heuristic(source_code)
-        new_lines = []
+            if i in blocks:
+                new_lines.append(f'#/{i}')
+                markers.append(Marker(i, len(new_lines), *blocks[i]))
+    except SyntaxError as e:
+        start = _lap(timings, 'parse', start)
+        error = e
+        engine = 'heuristic'
+        blocks = _heuristic_blocks(source_code)
+        start = _lap(timings, 'terminators', start)
         for i, line in enumerate(source_lines, 1):
-            if i in markers:
-                new_lines.append(f'#/{markers[i]}')
+            if i in blocks:
+                new_lines.append(f'#/{i}')
+                markers.append(Marker(i, len(new_lines), *blocks[i]))
             new_lines.append(line)
     
-    return '\n'.join(new_lines)
+    result = MarkedResult('\n'.join(new_lines), markers, engine, error)
+    _lap(timings, 'join', start)
+    return result, tree
+
+
+def convert_aithon(source_code, engine='auto'):
+    """Convert Python to Aithon format.
 
+    engine picks how block ends are found: 'ast', 'tokenize', or 'auto'
+    (tokenize above TOKENIZE_THRESHOLD characters, ast otherwise). Both
+    fall back to the heuristic on SyntaxError, but tokenize only raises
+    one for broken block structure (indentation, brackets, strings).
+    """
+    return analyze(source_code, engine).text
 
-def convert_file(input_path, output_path):
-    """Convert a single Python file."""
-    with open(input_path, 'r') as f:
-        source = f.read()
+
+def _split_marked(marked_source):
+    """Split marked text into source lines and marker positions.
+
+    A marker at position p sits after source line p. Returns
+    (source_lines, positions, numbers) with numbers[i] the N of the i-th
+    marker (None for a bare '#/').
+    """
+    all_lines = marked_source.split('\n')
+    source_lines = []
+    positions = []
+    numbers = []
+    line = pos = prev = 0
+    # search for the literal '#/' and check the line prefix, rather than
+    # trying a pattern at every line start
+    for m in _MARKER_TAIL.finditer(marked_source):
+        i = m.start()
+        start = marked_source.rfind('\n', 0, i) + 1
+        if start != i and not marked_source[start:i].isspace():
+            continue
+        line += marked_source.count('\n', pos, start)
+        pos = start
+        source_lines.extend(all_lines[prev:line])
+        prev = line + 1
+        positions.append(len(source_lines))
+        numbers.append(int(m.group(1)) if m.group(1) else None)
+    source_lines.extend(all_lines[prev:])
+    return source_lines, positions, numbers
+
+
+def _top_level_after(lines, p):
+    """Line number of the first code line after position p if it starts a
+    top-level statement, else None.
+
+    Markers only sit between statements, so that line is a statement
+    start; it is top-level when unindented and not an elif/else/except/
+    finally clause.
+    """
+    for i in range(p, len(lines)):
+        line = lines[i]
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if line[0].isspace() or stripped.split(None, 1)[0].rstrip(':') in _CONTINUATIONS:
+            return None
+        return i + 1
+    return None
+
+
+def apply_edit(marked_source, marker, replacement, engine='auto'):
+    """Replace the block after #/<marker> and re-mark only what it touches.
+
+    The block is everything between that marker and the next one.
+    Only the top-level statements around the edit are re-parsed; markers
+    before them are kept and markers after them are shifted by the change
+    in line count. Falls back to a full convert_aithon when the file was
+    marked by the heuristic or the re-parsed region doesn't parse alone.
+    Raises ValueError if the marker isn't in marked_source.
+    """
+    source_lines, positions, numbers = _split_marked(marked_source)
+    try:
+        idx = numbers.index(marker)
+    except ValueError:
+        raise ValueError(f"marker #/{marker} not found") from None
+    k = positions[idx]
+    j = positions[idx + 1] if idx + 1 < len(positions) else len(source_lines)
     
-    aithon_code = convert_aithon(source)
+    new_lines = _strip_markers(replacement).split('\n')
+    if replacement.endswith('\n'):
+        new_lines.pop()
+    lines = source_lines[:k] + new_lines + source_lines[j:]
+    delta = len(new_lines) - (j - k)
     
-    if output_path:
+    # ast-style files number each marker after the line it follows
+    if any(n != p for n, p in zip(numbers, positions)):
+        return convert_aithon('\n'.join(lines), engine)
+    
+    # re-parse [a, b): from the nearest top-level statement start that
+    # follows a marker above the edit, to the next one below it (old text).
+    # The start must lie before the edit: new lines right after #/<marker>
+    # may continue the statement that ended there.
+    a = 1
+    for p in reversed(positions[:idx]):
+        start = _top_level_after(source_lines, p)
+        if start is not None and start <= k:
+            a = start
+            break
+    b = len(lines) + 1
+    for p in positions[idx + 1:]:
+        end = _top_level_after(source_lines, p)
+        if end is not None:
+            b = end + delta
+            break
+    
+    try:
+        chunk = lines[a - 1:b - 1]
+        chunk = _ast_blocks(ast.parse('\n'.join(chunk)), chunk)
+    except SyntaxError:
+        return convert_aithon('\n'.join(lines), engine)
+    at_eof = b > len(lines)
+    new_positions = [p for p in positions if p < a]
+    new_positions.extend(sorted(a - 1 + line for line, info in chunk.items()
+                                if at_eof or info[0] != 'Module'))
+    new_positions.extend(p + delta for p in positions if p >= b - delta)
+    
+    out = []
+    prev = 0
+    for p in new_positions:
+        out.extend(lines[prev:p])
+        out.append(f'#/{p}')
+        prev = p
+    out.extend(lines[prev:])
+    return '\n'.join(out)
+
+
+# per-line endings of a file that mixes them: the '\n'-joined lines,
+# the ending of each ('' after the last) and the most common ending
+_Endings = namedtuple('_Endings', 'lines endings default')
+
+
+def _decode_source(data):
+    """Decode .py file bytes: returns (text, encoding, newline).
+
+    The encoding comes from the BOM or PEP 263 coding cookie
+    (tokenize.detect_encoding), utf-8 by default or when the cookie is
+    unusable. Undecodable bytes are kept as surrogates
+    (surrogateescape), so _encode_source gives back the same bytes.
+    text has '\n' throughout; newline is the file's line ending, or an
+    _Endings with every line's own ending when the file mixes them.
+    """
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    except SyntaxError:
+        encoding = 'utf-8'
+    text = data.decode(encoding, 'surrogateescape')
+    if '\r' not in text:
+        return text, encoding, '\n'
+    crlf = text.count('\r\n')
+    if crlf == text.count('\r') == text.count('\n'):
+        return text.replace('\r\n', '\n'), encoding, '\r\n'
+    if '\n' not in text:
+        return text.replace('\r', '\n'), encoding, '\r'
+    lines = _NEWLINE.split(text)
+    endings = _NEWLINE.findall(text) + ['']
+    default = max(('\n', '\r\n', '\r'), key=endings.count)
+    return '\n'.join(lines), encoding, _Endings(lines, endings, default)
+
+
+def _restore_endings(text, newline):
+    """Give each line of text its original ending from newline, an _Endings.
+
+    Output lines are matched up with the source lines in order; marker
+    lines the conversion stripped are skipped, and marker lines it added
+    take the ending of the line before them. If the lines no longer line
+    up (an edit replaced some), every line gets the most common ending.
+    """
+    lines, endings, default = newline
+    parts = []
+    i, end = 0, default
+    out = text.split('\n')
+    for line in out[:-1]:
+        while i < len(lines) and line != lines[i] and _MARKER_ONLY.fullmatch(lines[i]):
+            i += 1
+        if i < len(lines) and line == lines[i]:
+            end = endings[i] or default
+            i += 1
+        elif not _MARKER_ONLY.fullmatch(line):
+            return text.replace('\n', default)
+        parts.append(line)
+        # as in _strip_marker_lines: \r then an empty \n line would read as one \r\n
+        parts.append('\r' if not line and end == '\n' and parts[-2:-1] == ['\r'] else end)
+    parts.append(out[-1])
+    return ''.join(parts)
+
+
+def _encode_source(text, encoding='utf-8', newline='\n'):
+    """Inverse of _decode_source: text with '\n' back to the file's bytes."""
+    if isinstance(newline, _Endings):
+        text = _restore_endings(text, newline)
+    elif newline != '\n':
+        text = text.replace('\n', newline)
+    return text.encode(encoding, 'surrogateescape')
+
+
+def _read_source(path):
+    """Read and decode a .py file: returns (text, encoding, newline, size in bytes)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return _decode_source(data) + (len(data),)
+
+
+def _same_content(path, data, size=None):
+    """Whether the file at path holds exactly data; size is its st_size if known."""
+    if size is None:
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return False
+    if size != len(data):
+        return False
+    with open(path, 'rb') as f:
+        return f.read() == data
+
+
+def _write_output(output_path, data):
+    """Write the bytes data to output_path atomically, unless it already holds exactly that.
+
+    An existing file of the same size is compared byte for byte and left alone (mtime
+    included) when equal. Otherwise the bytes go to a temp file in the
+    same directory, which then replaces output_path with os.replace, so
+    readers never see a half-written file (see _replace_output for
+    symlinks, permissions and owner). Returns (written, size in bytes).
+    """
+    try:
+        st = os.stat(output_path)
+    except FileNotFoundError:
+        st = None
         output_dir = os.path.dirname(output_path)
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
-        with open(output_path, 'w') as f:
-            f.write(aithon_code)
-        return f"Converted: {input_path} -> {output_path}"
+    if st is not None and _same_content(output_path, data, st.st_size):
+        return False, len(data)
+    _replace_output(output_path, st, (data,))
+    return True, len(data)
+
+
+_TEMP_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+
+def _replace_output(output_path, st, chunks):
+    """Write chunks to a temp file and os.replace output_path with it; returns the size.
+
+    st is output_path's stat result, or None if it does not exist yet.
+    A symlink is resolved first, so the file it points to is replaced
+    and the link stays. The temp file is opened with O_EXCL under a
+    random name, so concurrent writers (serve_unix threads, several
+    processes) never share one, and with mode 0666 so a new output gets
+    the umask applied by the kernel. An existing file's permission bits
+    are kept, and its owner and group where the process may set them
+    (usually only root can give a file away); otherwise the replaced
+    file belongs to the user running aithon.
+    """
+    output_path = os.path.realpath(output_path)
+    prefix = os.path.join(os.path.dirname(output_path), os.path.basename(output_path) + '.')
+    while True:
+        tmp = f'{prefix}{os.urandom(4).hex()}.tmp'
+        try:
+            fd = os.open(tmp, _TEMP_FLAGS, 0o666)
+            break
+        except FileExistsError:
+            pass
+    try:
+        with open(fd, 'wb') as f:
+            f.writelines(chunks)
+            size = f.tell()
+            created = os.fstat(fd)
+        if st is not None:
+            if hasattr(os, 'chown') and (st.st_uid, st.st_gid) != (created.st_uid,
+                                                                   created.st_gid):
+                try:
+                    os.chown(tmp, st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+            os.chmod(tmp, st.st_mode & 0o7777)
+        os.replace(tmp, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def edit_file(input_path, marker, replacement, output_path=None, engine='auto'):
+    """Apply apply_edit to a marked file, in place unless output_path is given.
+
+    The result is written in the file's own encoding; ValueError if the
+    replacement holds characters that encoding can't represent.
+    """
+    source, encoding, newline, _ = _read_source(input_path)
+    
+    edited = apply_edit(source, marker, replacement, engine)
+    try:
+        data = _encode_source(edited, encoding, newline)
+    except UnicodeEncodeError as e:
+        raise ValueError(f"{input_path} is {encoding}, which can't hold "
+                         f"{e.object[e.start:e.end]!r} from the replacement") from None
+    
+    output_path = output_path or input_path
+    _write_output(output_path, data)
+    return f"Edited: #/{marker} in {input_path} -> {output_path}"
+
+
+class Stats:
+    """Per-phase timings summed over a run.
+
+    Pass one as stats= to convert_file or convert_directory, then
+    print(stats.report()). Phase times are summed across worker
+    processes, so with jobs > 1 they can exceed the wall-clock time.
+    Only the slowest files are kept, not one entry per file.
+    """
+    PHASES = ('walk', 'read', 'strip', 'parse', 'terminators', 'join', 'write')
+    
+    def __init__(self, slowest=10):
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.files = 0
+        self.bytes = 0
+        self.slowest = slowest
+        self._heap = []  # (seconds, path), smallest first
+        self.started = time.perf_counter()
+    
+    def add(self, path, nbytes, timings):
+        """Record one file: its size and the phase timings it took."""
+        for phase, seconds in timings.items():
+            self.phases[phase] += seconds
+        self.files += 1
+        self.bytes += nbytes
+        self._push((sum(timings.values()), str(path)))
+    
+    def merge(self, other):
+        """Fold in the Stats of another process."""
+        for phase, seconds in other.phases.items():
+            self.phases[phase] += seconds
+        self.files += other.files
+        self.bytes += other.bytes
+        for item in other._heap:
+            self._push(item)
+    
+    def _push(self, item):
+        if len(self._heap) < self.slowest:
+            heapq.heappush(self._heap, item)
+        elif self.slowest:
+            heapq.heappushpop(self._heap, item)
+    
+    def slowest_files(self):
+        """[(seconds, path), ...], slowest first."""
+        return sorted(self._heap, reverse=True)
+    
+    def report(self):
+        """Phase breakdown, totals and the slowest files as text."""
+        elapsed = time.perf_counter() - self.started
+        total = sum(self.phases.values()) or 1.0
+        lines = [f"{'phase':<12} {'seconds':>9} {'share':>6}"]
+        for phase in self.PHASES:
+            seconds = self.phases[phase]
+            lines.append(f"{phase:<12} {seconds:>9.3f} {seconds / total:>6.1%}")
+        rate = elapsed or 1e-9
+        lines.append(f"{self.files} files, {self.bytes / 1e6:.2f} MB in {elapsed:.2f} s: "
+                     f"{self.files / rate:.1f} files/sec, {self.bytes / 1e6 / rate:.2f} MB/sec")
+        if self._heap:
+            lines.append("slowest:")
+            lines.extend(f"  {seconds:9.3f} s  {path}" for seconds, path in self.slowest_files())
+        return "\n".join(lines)
+
+
+REPORT_FIELDS = ('path', 'output', 'status', 'input_bytes', 'output_bytes', 'lines',
+                 'markers', 'engine', 'syntax_error', 'seconds')
+
+
+def _record(**fields):
+    """Report record with every REPORT_FIELDS key; missing ones are None."""
+    record = dict.fromkeys(REPORT_FIELDS)
+    record.update(fields)
+    return record
+
+
+def _result_fields(source, result):
+    """Report fields describing analyze(source): lines, markers, engine, syntax_error."""
+    error = result.error
+    if error is not None:
+        error = {'line': error.lineno, 'column': error.offset, 'message': error.msg}
+    return {'lines': source.count('\n') + (not source.endswith('\n') and bool(source)),
+            'markers': len(result.markers), 'engine': result.engine, 'syntax_error': error}
+
+
+def _message(record):
+    return f"{record['status'].capitalize()}: {record['path']} -> {record['output']}"
+
+
+def _convert(input_path, output_path, engine='auto', stats=None, data=None):
+    """Convert input_path into output_path and return its report record.
+
+    data, the file's bytes, is used instead of reading input_path if given.
+    The output keeps the source's encoding and line endings.
+    """
+    timings = {} if stats is not None else None
+    began = start = time.perf_counter()
+    if data is None:
+        with open(input_path, 'rb') as f:
+            data = f.read()
+    nbytes = len(data)
+    source, encoding, newline = _decode_source(data)
+    start = _lap(timings, 'read', start)
+    
+    result = analyze(source, engine, timings)
+    
+    start = time.perf_counter()
+    written, out_bytes = _write_output(output_path, _encode_source(result.text, encoding, newline))
+    end = _lap(timings, 'write', start)
+    if stats is not None:
+        stats.add(input_path, nbytes, timings)
+    
+    return _record(path=str(input_path), output=str(output_path),
+                   status='converted' if written else 'unchanged',
+                   input_bytes=nbytes, output_bytes=out_bytes, seconds=round(end - began, 6),
+                   **_result_fields(source, result))
+
+
+def convert_file(input_path, output_path, engine='auto', stats=None, report=None):
+    """Convert a single Python file.
+
+    stats, a Stats instance, collects the per-phase timings of this file;
+    report, a callable, receives its record (a dict with REPORT_FIELDS).
+    """
+    if output_path:
+        record = _convert(input_path, output_path, engine, stats)
+        if report is not None:
+            report(record)
+        return _message(record)
     else:
-        print(aithon_code)
+        print(convert_aithon(_read_source(input_path)[0], engine))
         return None
 
 
-def convert_directory(source_dir, target_dir, dry_run=False, process='replica'):
-    """Convert all .py files in a directory."""
+def convert_stream(infile=None, outfile=None, engine='auto', stats=None, report=None):
+    """Mark the Python source read from infile and write it to outfile.
+
+    Both are binary files, stdin and stdout by default. The parse needs
+    the whole source, so infile is read to the end first; the output is
+    flushed as soon as it is written. Returns the report record, which
+    report (a callable) also receives.
+    """
+    name = '-' if infile is None else getattr(infile, 'name', '-')
+    infile = infile or sys.stdin.buffer
+    outfile = outfile or sys.stdout.buffer
+    timings = {} if stats is not None else None
+    began = start = time.perf_counter()
+    data = infile.read()
+    source, encoding, newline = _decode_source(data)
+    start = _lap(timings, 'read', start)
+    
+    result = analyze(source, engine, timings)
+    
+    start = time.perf_counter()
+    out = _encode_source(result.text, encoding, newline)
+    outfile.write(out)
+    outfile.flush()
+    end = _lap(timings, 'write', start)
+    if stats is not None:
+        stats.add(name, len(data), timings)
+    record = _record(path=str(name), output='-', status='converted', input_bytes=len(data),
+                     output_bytes=len(out), seconds=round(end - began, 6),
+                     **_result_fields(source, result))
+    if report is not None:
+        report(record)
+    return record
+
+
+class _ReportWriter:
+    """report= callable that streams records to a file.
+
+    '-' and *.jsonl paths get JSON Lines (one record per line); any other
+    path gets a JSON array, written as records arrive.
+    """
+    
+    def __init__(self, path):
+        self.lines = path == '-' or path.endswith('.jsonl')
+        self.file = sys.stdout if path == '-' else open(path, 'w')
+        self.count = 0
+        if not self.lines:
+            self.file.write('[')
+    
+    def __call__(self, record):
+        if not self.lines:
+            self.file.write(',\n' if self.count else '\n')
+        json.dump(record, self.file)
+        if self.lines:
+            self.file.write('\n')
+            self.file.flush()
+        self.count += 1
+    
+    def close(self):
+        """Finish the file; later calls do nothing."""
+        if self.file is None:
+            return
+        if not self.lines:
+            self.file.write('\n]\n' if self.count else ']\n')
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+        self.file = None
+
+
+def _target_file(py_file, input_path, target_dir, process):
+    """Output path for py_file under the replica/inplace naming rules."""
+    if process == 'inplace':
+        return py_file
+    stem = py_file.relative_to(input_path).stem
+    if not stem.endswith('_ai'):
+        stem = stem + '_ai'
+    if target_dir:
+        return type(py_file)(target_dir) / (stem + '.py')
+    return py_file.parent / (stem + '.py')
+
+
+def _map_jobs(func, items, jobs=1):
+    """Apply func to each item, in a process pool when jobs > 1.
+
+    Results come back in the order of items regardless of which worker
+    finishes first.
+    """
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(items) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=min(jobs, len(items))) as pool:
+        return list(pool.map(func, items, chunksize=chunksize))
+
+
+def _run_batch(job):
+    func, batch = job
+    return [func(item) for item in batch]
+
+
+def _iter_jobs(func, items, jobs=1, batch=16):
+    """Apply func to each item lazily, yielding results as they complete.
+
+    items may be any iterable. Work goes to the pool in batches of
+    `batch` items with at most jobs * 2 batches in flight, so memory stays
+    flat however many items there are. Results come back in completion
+    order; with one job (or fewer than two items) everything runs in this
+    process, in order.
+    """
+    items = iter(items)
+    # with one job, nothing is read ahead: each result is out before the next item is taken
+    head = [item for _, item in zip(range(2), items)] if jobs > 1 else []
+    if len(head) <= 1:
+        for item in head:
+            yield func(item)
+        for item in items:
+            yield func(item)
+        return
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from itertools import chain, islice
+    items = chain(head, items)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = set()
+        while True:
+            while len(pending) < jobs * 2:
+                chunk = list(islice(items, batch))
+                if not chunk:
+                    break
+                pending.add(pool.submit(_run_batch, (func, chunk)))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def _indexed_job(job):
+    """Worker: (index, func, item) -> (index, func(item)), to put results back in order."""
+    index, func, item = job
+    return index, func(item)
+
+
+def _in_order(pairs):
+    """Yield the values of (index, value) pairs by index 0, 1, 2, ...
+
+    pairs may come in any order; a value that arrives early is held until
+    every lower index has been yielded.
+    """
+    held = []
+    expected = 0
+    for pair in pairs:
+        heapq.heappush(held, pair)
+        while held and held[0][0] == expected:
+            yield heapq.heappop(held)[1]
+            expected += 1
+
+
+def _iter_ordered(func, items, jobs=1):
+    """_iter_jobs, but yielding the results in the order of items."""
+    indexed = ((index, func, item) for index, item in enumerate(items))
+    return _in_order(_iter_jobs(_indexed_job, indexed, jobs))
+
+
+def _convert_job(job):
+    """Worker: convert one (source, target) pair unless the cache says it's fresh.
+
+    Returns (record, cache_entry, stats); the entry is None unless
+    caching, stats None unless timed.
+    """
+    py_file, out_file, cached, old_entry, engine, timed = job
+    if cached and _is_cached(old_entry, py_file, out_file):
+        record = _record(path=str(py_file), output=str(out_file), status='cached',
+                         input_bytes=old_entry['size'])
+        return record, old_entry, None
+    stats = Stats() if timed else None
+    entry = None
+    if cached and out_file != py_file:
+        entry = _cache_entry(py_file, out_file)
+    if out_file.parent != py_file.parent:
+        os.makedirs(out_file.parent, exist_ok=True)
+    record = _convert(py_file, out_file, engine, stats)
+    if cached and out_file == py_file:
+        # replace mode: the source now holds the marked output
+        entry = _cache_entry(py_file, out_file)
+    return record, entry, stats
+
+
+def _revert_job(job):
+    """Worker: restore one (source, target) pair."""
+    py_file, out_file = job
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    revert_file(py_file, out_file)
+    return _record(path=str(py_file), output=str(out_file), status='reverted')
+
+
+_ENGINE_FINGERPRINT = None
+
+
+def _engine_fingerprint():
+    """Hash of this module and the Python version.
+
+    Any change to the marker logic or the ast module's line numbers
+    invalidates cached outputs.
+    """
+    global _ENGINE_FINGERPRINT
+    if _ENGINE_FINGERPRINT is None:
+        digest = hashlib.sha256(Path(__file__).read_bytes())
+        digest.update(sys.version.encode())
+        _ENGINE_FINGERPRINT = digest.hexdigest()
+    return _ENGINE_FINGERPRINT
+
+
+def _cache_entry(py_file, out_file):
+    """Manifest record for a source file: content hash, size, mtime, target."""
+    st = os.stat(py_file)
+    return {
+        'sha256': hashlib.sha256(Path(py_file).read_bytes()).hexdigest(),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'target': str(out_file),
+    }
+
+
+def _load_cache(manifest, source_dir, engine):
+    """Load manifest entries, or {} if missing, stale or for another tree."""
+    try:
+        with open(manifest, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if (data.get('engine') != _engine_fingerprint() or data.get('source') != source_dir
+            or data.get('mode') != engine):
+        return {}
+    return data.get('files', {})
+
+
+def _save_cache(manifest, source_dir, engine, files):
+    os.makedirs(os.path.dirname(manifest) or '.', exist_ok=True)
+    tmp = f"{manifest}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'engine': _engine_fingerprint(), 'mode': engine, 'source': source_dir,
+                   'files': files}, f)
+    os.replace(tmp, manifest)
+
+
+def _is_cached(entry, py_file, out_file):
+    """True when py_file still matches entry and its output exists."""
+    if not entry or entry.get('target') != str(out_file) or not out_file.exists():
+        return False
+    return _unchanged(entry, py_file)
+
+
+def _unchanged(entry, py_file):
+    """True when py_file still has the size and content recorded in entry.
+
+    Size and mtime are checked first; the content hash is only computed
+    when the mtime moved (fresh checkouts, touch) but the size did not.
+    """
+    st = os.stat(py_file)
+    if st.st_size != entry['size']:
+        return False
+    if st.st_mtime_ns == entry['mtime_ns']:
+        return True
+    if hashlib.sha256(py_file.read_bytes()).hexdigest() != entry['sha256']:
+        return False
+    entry['mtime_ns'] = st.st_mtime_ns
+    return True
+
+
+def iter_convert(source_dir, target_dir, process='replica', jobs=1, cache_dir=None,
+                 engine='auto', stats=None, exclude=(), gitignore=True, max_file_size=None,
+                 ordered=False):
+    """Convert all .py files in a directory, yielding a record per file as it finishes.
+
+    Records are dicts with REPORT_FIELDS (status 'converted', 'unchanged'
+    when the existing output already matched, or 'cached').
+    The tree is walked lazily and never held as a list; with jobs > 1
+    records arrive in completion order, unless ordered is true: then they
+    come in walk order, a record being held back until every file walked
+    before it is done. Other arguments are as for convert_directory. With
+    cache_dir the manifest is saved when the generator finishes or is
+    closed, covering the files seen so far.
+    """
+    records = _iter_convert(source_dir, target_dir, process, jobs, cache_dir, engine, stats,
+                            exclude, gitignore, max_file_size)
+    try:
+        for record in _in_order(records) if ordered else (record for _, record in records):
+            yield record
+    finally:
+        records.close()
+
+
+def _iter_convert(source_dir, target_dir, process, jobs, cache_dir, engine, stats, exclude,
+                  gitignore, max_file_size):
+    """iter_convert, yielding (walk index, record) so callers can restore walk order."""
     input_path = Path(source_dir)
-    py_files = list(input_path.rglob("*.py"))
+    timed = stats is not None
+    cached = cache_dir is not None
+    if cached:
+        manifest = os.path.join(cache_dir, CACHE_FILE)
+        source_key = str(input_path.resolve())
+        old = _load_cache(manifest, source_key, engine)
+        files = {}
     
-    if not py_files:
-        return f"No .py files found in {source_dir}"
+    def walk():
+        paths = walk_py_files(input_path, exclude=exclude, gitignore=gitignore, max_file_size=max_file_size)
+        index = 0
+        while True:
+            start = time.perf_counter()
+            py_file = next(paths, None)
+            if py_file is None:
+                break
+            out_file = _target_file(py_file, input_path, target_dir, process)
+            old_entry = old.get(py_file.relative_to(input_path).as_posix()) if cached else None
+            if timed:
+                _lap(stats.phases, 'walk', start)
+            yield index, _convert_job, (py_file, out_file, cached, old_entry, engine, timed)
+            index += 1
     
-    results = []
-    for py_file in py_files:
-        rel_path = py_file.relative_to(input_path)
-        
-        if process == 'inplace':
-            out_file = py_file
+    try:
+        for index, (record, entry, file_stats) in _iter_jobs(_indexed_job, walk(), jobs):
+            if file_stats is not None:
+                stats.merge(file_stats)
+            if cached:
+                files[Path(record['path']).relative_to(input_path).as_posix()] = entry
+            yield index, record
+    finally:
+        if cached:
+            _save_cache(manifest, source_key, engine, files)
+
+
+def convert_directory(source_dir, target_dir, dry_run=False, process='replica', jobs=1,
+                      cache_dir=None, engine='auto', stats=None, report=None,
+                      exclude=(), gitignore=True, max_file_size=None):
+    """Convert all .py files in a directory.
+
+    jobs sets the number of worker processes; the default, 1, converts in
+    this process without starting a pool (the CLI defaults to the CPU count).
+    cache_dir enables the incremental manifest (CACHE_FILE in that
+    directory): files whose content and engine are unchanged since the
+    last run are skipped. engine is passed on to convert_aithon. stats, a
+    Stats instance, collects per-phase timings of the converted files.
+    report, a callable, receives one record per file as it finishes
+    (see REPORT_FIELDS; cached files have status 'cached'). exclude,
+    gitignore and max_file_size pick the files, see walk_py_files.
+    
+    Returns all messages joined; use iter_convert to stream instead.
+    """
+    input_path = Path(source_dir)
+    if dry_run:
+        messages = [f"DRY RUN: {py_file} -> {_target_file(py_file, input_path, target_dir, process)}"
+                    for py_file in walk_py_files(input_path, exclude=exclude, gitignore=gitignore, max_file_size=max_file_size)]
+    else:
+        messages = []
+        for record in iter_convert(source_dir, target_dir, process, jobs, cache_dir, engine,
+                                   stats, exclude, gitignore, max_file_size, ordered=True):
+            if report is not None:
+                report(record)
+            messages.append(_message(record))
+    return "\n".join(messages) if messages else f"No .py files found in {source_dir}"
+
+
+def iter_revert(source_dir, target_dir, jobs=1, exclude=(), gitignore=True, max_file_size=None):
+    """Remove markers from all .py files in a directory, yielding a record per file.
+
+    Like iter_convert, the tree is walked lazily; records have status 'reverted'.
+    """
+    input_path = Path(source_dir)
+    output_path = Path(target_dir)
+    pairs = ((py_file, output_path / py_file.relative_to(input_path).name)
+             for py_file in walk_py_files(input_path, exclude=exclude, gitignore=gitignore, max_file_size=max_file_size))
+    return _iter_jobs(_revert_job, pairs, jobs)
+
+
+def revert_directory(source_dir, target_dir, jobs=1, exclude=(), gitignore=True, max_file_size=None):
+    """Remove markers from all .py files in a directory."""
+    count = sum(1 for _ in iter_revert(source_dir, target_dir, jobs, exclude=exclude, gitignore=gitignore, max_file_size=max_file_size))
+    return f"Restored {count} files"
+
+
+def _mapping_job(job):
+    """Worker: convert or restore one in-memory source; returns (output path, output)."""
+    out_path, source, engine, restore = job
+    if restore:
+        return out_path, revert_aithon(source)
+    if isinstance(source, str):
+        return out_path, convert_aithon(source, engine)
+    text, encoding, newline = _decode_source(source)
+    return out_path, _encode_source(convert_aithon(text, engine), encoding, newline)
+
+
+def convert_mapping(sources, target_dir=None, process='replica', jobs=1, engine='auto',
+                    out=None):
+    """convert_directory for a tree held in memory.
+
+    sources maps paths (str or PathLike, '/'-separated) to source code,
+    str or bytes; bytes keep their encoding and line endings as on disk.
+    Anything with .items() will do, so an object-cache adapter can stand
+    in for a dict. Entries not ending in .py are skipped. Output paths
+    follow convert_directory's rules: with process='replica', foo.py
+    becomes foo_ai.py next to it, or directly in target_dir if given;
+    with process='inplace' the path is kept. Results go into out (any
+    mapping supporting item assignment; a new dict by default), which is
+    returned. jobs and engine are as for convert_directory.
+    """
+    out = {} if out is None else out
+    work = ((str(_target_file(path, path.parent, target_dir, process)), source, engine, False)
+            for path, source in _py_items(sources))
+    for out_path, output in _iter_jobs(_mapping_job, work, jobs):
+        out[out_path] = output
+    return out
+
+
+def revert_mapping(sources, target_dir=None, jobs=1, out=None):
+    """revert_directory for a tree held in memory.
+
+    Like convert_mapping: each .py entry of sources is restored into
+    out under target_dir/<file name>, as revert_directory names it, or
+    under its own path when target_dir is None. Returns out.
+    """
+    out = {} if out is None else out
+    work = ((str(PurePosixPath(target_dir) / path.name if target_dir else path), source, None, True)
+            for path, source in _py_items(sources))
+    for out_path, output in _iter_jobs(_mapping_job, work, jobs):
+        out[out_path] = output
+    return out
+
+
+def _py_items(sources):
+    """(PurePosixPath, source) for the .py entries of a path -> source mapping."""
+    for path, source in sources.items():
+        path = PurePosixPath(os.fspath(path))
+        if path.suffix == '.py':
+            yield path, source
+
+
+def _gitignore_regex(pattern):
+    """Compile one .gitignore pattern (already stripped of '!' and a trailing '/').
+
+    Patterns with a '/' other than at the end are anchored to the
+    .gitignore's directory; others match a name at any depth.
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                i = j
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
         else:
-            if target_dir:
-                output_path = Path(target_dir)
-                stem = rel_path.stem
-                if not stem.endswith('_ai'):
-                    stem = stem + '_ai'
-                out_file = output_path / (stem + '.py')
+            out.append(re.escape(c))
+        i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    return re.compile(prefix + ''.join(out) + r'\Z')
+
+
+def _read_gitignore(path):
+    """[(regex, negate, dir_only), ...] for a .gitignore file, [] if unreadable."""
+    try:
+        with open(path, 'r', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if line:
+            rules.append((_gitignore_regex(line), negate, dir_only))
+    return rules
+
+
+def _ignored(rulesets, rel, is_dir):
+    """Whether rel (posix path from the walk root) is ignored; the last match wins."""
+    ignored = False
+    for strip, add, rules in rulesets:
+        path = add + rel[strip:]
+        for regex, negate, dir_only in rules:
+            if (is_dir or not dir_only) and regex.match(path):
+                ignored = not negate
+    return ignored
+
+
+def check_file(input_path, output_path, engine='auto'):
+    """Compare output_path with what converting input_path would produce. Writes nothing.
+
+    Returns a record (REPORT_FIELDS) with status 'fresh', 'stale' or
+    'missing'.
+    """
+    began = time.perf_counter()
+    source, encoding, newline, nbytes = _read_source(input_path)
+    result = analyze(source, engine)
+    data = _encode_source(result.text, encoding, newline)
+    try:
+        status = 'fresh' if _same_content(output_path, data) else 'stale'
+    except OSError:
+        status = 'stale'
+    if status == 'stale' and not os.path.exists(output_path):
+        status = 'missing'
+    return _record(path=str(input_path), output=str(output_path), status=status,
+                   input_bytes=nbytes, output_bytes=len(data),
+                   seconds=round(time.perf_counter() - began, 6), **_result_fields(source, result))
+
+
+def _check_job(job):
+    py_file, out_file, engine = job
+    return check_file(py_file, out_file, engine)
+
+
+def iter_check(source_dir, target_dir, process='replica', jobs=1, engine='auto',
+               exclude=(), gitignore=True, max_file_size=None, ordered=False):
+    """check_file every .py file of a directory run, in parallel; yields records.
+
+    Targets are named as by iter_convert; nothing is written. ordered is
+    as for iter_convert.
+    """
+    input_path = Path(source_dir)
+    pairs = ((py_file, _target_file(py_file, input_path, target_dir, process), engine)
+             for py_file in walk_py_files(input_path, exclude=exclude, gitignore=gitignore,
+                                          max_file_size=max_file_size))
+    return (_iter_ordered if ordered else _iter_jobs)(_check_job, pairs, jobs)
+
+
+def _first_difference(expected, actual):
+    """(line number, expected line, actual line) of the first differing line, or None."""
+    expected_lines = expected.split('\n')
+    actual_lines = actual.split('\n')
+    for i, (a, b) in enumerate(zip(expected_lines, actual_lines), 1):
+        if a != b:
+            return i, a, b
+    if len(expected_lines) != len(actual_lines):
+        i = min(len(expected_lines), len(actual_lines)) + 1
+        return (i, expected_lines[i - 1] if i <= len(expected_lines) else None,
+                actual_lines[i - 1] if i <= len(actual_lines) else None)
+    return None
+
+
+def _verify_text(source, engine='auto'):
+    """verify_source, also returning the marked text."""
+    result, tree = _analyze(source, engine)
+    reverted = revert_aithon(result.text)
+    record = {'status': 'ok', 'engine': result.engine, 'round_trip': reverted == source,
+              'ast': None, 'line': None, 'expected': None, 'actual': None}
+    if not record['round_trip']:
+        record['line'], record['expected'], record['actual'] = _first_difference(source, reverted)
+    if tree is None or not record['round_trip']:
+        # tree is the ast of source with old markers stripped, which is only
+        # source itself when the round trip held (or wasn't built at all)
+        tree = None
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            pass
+    if tree is not None:
+        try:
+            record['ast'] = ast.dump(ast.parse(result.text)) == ast.dump(tree)
+        except (SyntaxError, ValueError):
+            record['ast'] = False
+    if not record['round_trip'] or record['ast'] is False:
+        record['status'] = 'mismatch'
+    return record, result.text
+
+
+def verify_source(source, engine='auto'):
+    """Check that marking source is lossless and doesn't change what it means.
+
+    revert_aithon(convert_aithon(source)) must equal source, and when
+    source parses, the marked text must have the same ast.dump. Old
+    #/<line> lines count as changes: a file that loses one (say, inside a
+    string) is a mismatch. Returns a dict: status 'ok' or 'mismatch', engine,
+    round_trip (bool), ast (bool, None when source doesn't parse) and, on
+    a round-trip mismatch, line/expected/actual of the first differing line.
+    """
+    return _verify_text(source, engine)[0]
+
+
+def verify_file(path, engine='auto'):
+    """verify_source on a file, plus the same round trip on its bytes.
+
+    The marked text is encoded as convert_file would write it and
+    un-marked as revert_file would; the result must equal the file's bytes,
+    so encodings and line endings survive too. The record also carries the
+    path. A file that can't be read gets status
+    'error' and the reason in 'error' instead of stopping a bulk run.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        return {'status': 'error', 'path': str(path), 'error': str(e)}
+    source, encoding, newline = _decode_source(data)
+    record, marked = _verify_text(source, engine)
+    if record['round_trip']:
+        reverted = revert_aithon(_encode_source(marked, encoding, newline))
+        if reverted != data:
+            record['status'] = 'mismatch'
+            record['round_trip'] = False
+            record['line'], record['expected'], record['actual'] = _first_difference(
+                data.decode('latin-1'), reverted.decode('latin-1'))
+    record['path'] = str(path)
+    return record
+
+
+def _verify_job(job):
+    path, engine = job
+    return verify_file(path, engine)
+
+
+def iter_verify(source_dir, jobs=1, engine='auto', exclude=(), gitignore=True,
+                max_file_size=None, ordered=False):
+    """verify_file every .py file under source_dir across worker processes; yields records.
+
+    ordered is as for iter_convert.
+    """
+    paths = ((py_file, engine)
+             for py_file in walk_py_files(source_dir, exclude=exclude, gitignore=gitignore,
+                                          max_file_size=max_file_size))
+    return (_iter_ordered if ordered else _iter_jobs)(_verify_job, paths, jobs)
+
+
+BATCH_ACTIONS = ('convert', 'restore')
+
+
+def _batch_job(job):
+    """Worker: answer one JSON Lines request {id, source, action}."""
+    lineno, line, engine = job
+    req_id = None
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        req_id = request.get('id')
+        source = request.get('source')
+        action = request.get('action', 'convert')
+        if not isinstance(source, str):
+            raise ValueError("source must be a string")
+        if action not in BATCH_ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(BATCH_ACTIONS)}")
+        if action == 'restore':
+            return {'id': req_id, 'output': revert_aithon(source), 'markers': None,
+                    'engine': None}
+        result = analyze(source, engine)
+    except ValueError as e:  # json.JSONDecodeError included
+        return {'id': req_id, 'error': f"line {lineno}: {e}"}
+    except Exception as e:
+        # RecursionError/MemoryError from absurdly nested source: fail this request only
+        return {'id': req_id, 'error': f"line {lineno}: {type(e).__name__}: {e}"}
+    return {'id': req_id, 'output': result.text,
+            'markers': [marker._asdict() for marker in result.markers], 'engine': result.engine}
+
+
+def iter_batch(lines, jobs=1, engine='auto'):
+    """Answer JSON Lines requests across worker processes; yields response dicts.
+
+    Each line of lines (any iterable of str, such as an open file) is
+    {"id": ..., "source": "...", "action": "convert" | "restore"}, action
+    defaulting to convert. Each response is {id, output, markers, engine},
+    markers being the Marker fields as dicts (None for restore); a bad
+    request gets {id, error} instead. Responses come in completion
+    order, so match them up by id; with one job they keep input order and
+    each comes out before the next line is read. Blank lines are skipped.
+    """
+    requests = ((lineno, line, engine)
+                for lineno, line in enumerate(lines, 1) if line.strip())
+    return _iter_jobs(_batch_job, requests, jobs, batch=64)
+
+
+def _excluded(exclude, name, rel):
+    """Whether name, or rel (its posix path from the walk root), matches an exclude glob."""
+    return any(fnmatch.fnmatch(name, pat) or fnmatch.fnmatch(rel, pat) for pat in exclude)
+
+
+def walk_py_files(root, exclude=(), gitignore=True, max_file_size=None):
+    """Yield every .py file under root as a Path, pruning as early as possible.
+
+    Directories in SKIP_DIRS are never entered. exclude holds glob
+    patterns matched against both the name and the path relative to root
+    (e.g. 'build', 'tests/*', '*_pb2.py'); a matching directory is not
+    entered. With gitignore, .gitignore files of root, its parents up to
+    the repository top and every walked directory are honoured. Files
+    larger than max_file_size bytes are skipped. Symlinked directories are
+    followed once: a directory already visited (same device and inode)
+    is not walked again, so symlink cycles end.
+    """
+    root = Path(root)
+    st = os.stat(root)
+    seen = {(st.st_dev, st.st_ino)}
+    stack = [(str(root), '', _root_rulesets(root) if gitignore else [])]
+    while stack:
+        path, rel_dir, rulesets = stack.pop()
+        listing = _list_dir(path, rel_dir, rulesets, exclude, gitignore)
+        if listing is None:
+            continue
+        rulesets, files, subdirs = listing
+        for entry in files:
+            if max_file_size is not None:
+                try:
+                    if entry.stat().st_size > max_file_size:
+                        continue
+                except OSError:
+                    continue
+            yield Path(entry.path)
+        children = []
+        for entry, rel in subdirs:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in seen:
+                continue
+            seen.add(key)
+            children.append((entry.path, rel, rulesets))
+        stack.extend(reversed(children))
+
+
+def _root_rulesets(root):
+    """The gitignore rulesets walk_py_files starts from at root.
+
+    They come from the .gitignore files of root and its parents up to the
+    repository top (the first directory holding .git).
+    """
+    top = Path(root).resolve()
+    parents = []
+    for parent in (top,) + tuple(top.parents):
+        parents.append(parent)
+        if (parent / '.git').exists():
+            break
+    else:
+        parents = [top]
+    rulesets = []
+    for parent in reversed(parents):
+        rules = _read_gitignore(parent / '.gitignore')
+        if rules:
+            add = top.relative_to(parent).as_posix()
+            rulesets.append((0, '' if add == '.' else add + '/', rules))
+    return rulesets
+
+
+def _list_dir(path, rel_dir, rulesets, exclude, gitignore):
+    """One directory of walk_py_files: (rulesets, files, subdirs), or None if unreadable.
+
+    rulesets are the ones given plus the directory's own .gitignore.
+    files holds the os.DirEntry of each .py file and subdirs (entry,
+    relative path) of each directory to walk, both in name order, with
+    SKIP_DIRS, excluded and ignored names left out.
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return None
+    if gitignore and rel_dir and any(e.name == '.gitignore' for e in entries):
+        rules = _read_gitignore(os.path.join(path, '.gitignore'))
+        if rules:
+            rulesets = rulesets + [(len(rel_dir) + 1, '', rules)]
+    files = []
+    subdirs = []
+    for entry in entries:
+        name = entry.name
+        rel = f"{rel_dir}/{name}" if rel_dir else name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            continue
+        if is_dir:
+            if name in SKIP_DIRS or _excluded(exclude, name, rel) or _ignored(rulesets, rel, True):
+                continue
+            subdirs.append((entry, rel))
+        elif name.endswith('.py'):
+            if _excluded(exclude, name, rel) or _ignored(rulesets, rel, False):
+                continue
+            files.append(entry)
+    return rulesets, files, subdirs
+
+
+def _git(source_dir, *args, input=None):
+    """Run git in source_dir and return its stdout bytes; ValueError if it fails."""
+    try:
+        proc = subprocess.run(('git', '-C', str(source_dir)) + args, input=input,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise ValueError(f"git not available: {e}")
+    if proc.returncode:
+        raise ValueError(f"git {args[0]} failed: {proc.stderr.decode(errors='replace').strip()}")
+    return proc.stdout
+
+
+def git_changed(source_dir, since=None, staged=False):
+    """Yield (path, data) for .py files under source_dir changed in git.
+
+    since: files that differ between that ref and the working tree, plus
+    untracked files not ignored by git; data is None (read the file).
+    staged: files with staged changes; data is their bytes in the
+    index, read with one git cat-file call, so the working tree is not
+    touched. Deleted files are left out. Raises ValueError when git fails.
+    """
+    _git(source_dir, 'rev-parse', '--git-dir')
+    if staged:
+        names = _git(source_dir, 'diff', '--cached', '--name-only', '--relative', '-z',
+                     '--diff-filter=ACMR', '--', '*.py')
+    else:
+        names = _git(source_dir, 'diff', '--name-only', '--relative', '-z',
+                     '--diff-filter=ACMR', since, '--', '*.py')
+        names += _git(source_dir, 'ls-files', '--others', '--exclude-standard', '-z',
+                      '--', '*.py')
+    paths = sorted(set(name for name in os.fsdecode(names).split('\0') if name))
+    if not staged:
+        for name in paths:
+            yield Path(source_dir) / name, None
+        return
+    batch = _git(source_dir, 'cat-file', '--batch',
+                 input=''.join(f":./{name}\n" for name in paths).encode())
+    pos = 0
+    for name in paths:
+        eol = batch.index(b'\n', pos)
+        size = int(batch[pos:eol].split()[2])
+        pos = eol + 1
+        yield Path(source_dir) / name, batch[pos:pos + size]
+        pos += size + 1
+
+
+def iter_changed(source_dir, target_dir, since=None, staged=False, process='replica',
+                 engine='auto', restore=False, exclude=(), stats=None):
+    """Convert (or with restore, un-mark) only the .py files git_changed reports.
+
+    Output paths follow the same rules as iter_convert / iter_revert and
+    one record per file is yielded. With staged the index content is
+    what gets converted; the working-tree file is never read.
+    """
+    input_path = Path(source_dir)
+    for py_file, data in git_changed(source_dir, since, staged):
+        rel = py_file.relative_to(input_path).as_posix()
+        if _excluded(exclude, py_file.name, rel):
+            continue
+        if restore:
+            out_file = Path(target_dir) / py_file.name
+            if data is None:
+                revert_file(py_file, out_file)
             else:
-                stem = rel_path.stem
-                if not stem.endswith('_ai'):
-                    stem = stem + '_ai'
-                out_file = py_file.parent / (stem + '.py')
-        
-        if dry_run:
-            results.append(f"DRY RUN: {py_file} -> {out_file}")
+                _write_output(out_file, revert_aithon(data))
+            yield _record(path=str(py_file), output=str(out_file), status='reverted')
         else:
-            if out_file.parent != py_file.parent:
-                os.makedirs(out_file.parent, exist_ok=True)
-            msg = convert_file(py_file, out_file)
-            results.append(msg)
+            out_file = _target_file(py_file, input_path, target_dir, process)
+            yield _convert(py_file, out_file, engine, stats, data)
+
+
+class _WatchedTree:
+    """The .py files walk_py_files would yield under root, kept current by polling.
+
+    Every walked directory is remembered with its mtime and its
+    .gitignore's stat. poll() re-lists only directories whose mtime
+    changed (a file or subdirectory added, removed or renamed), walks
+    again below one whose .gitignore changed, and otherwise just stats
+    the known files. The .gitignore files above root are read once.
+    """
+    
+    def __init__(self, root, exclude=(), gitignore=True, max_file_size=None):
+        self.root = str(root)
+        self.exclude = exclude
+        self.gitignore = gitignore
+        self.max_file_size = max_file_size
+        self.dirs = {}
+        self.seen = set()
+        self._walk(self.root, '', self._root_rules())
+    
+    def _root_rules(self):
+        return _root_rulesets(self.root) if self.gitignore else []
+    
+    def _ignore_sig(self, path):
+        if not self.gitignore:
+            return None
+        try:
+            st = os.stat(os.path.join(path, '.gitignore'))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+    
+    def _walk(self, path, rel_dir, inherited):
+        """List path and every new directory below it."""
+        stack = [(path, rel_dir, inherited)]
+        while stack:
+            path, rel_dir, inherited = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in self.seen:
+                continue
+            ignore = self._ignore_sig(path)
+            listing = _list_dir(path, rel_dir, inherited, self.exclude, self.gitignore)
+            if listing is None:
+                continue
+            rulesets, files, subdirs = listing
+            self.seen.add(key)
+            self.dirs[path] = {
+                'mtime': st.st_mtime_ns, 'ignore': ignore, 'key': key, 'rel': rel_dir,
+                'inherited': inherited, 'rulesets': rulesets,
+                'files': [Path(entry.path) for entry in files],
+                'subdirs': [entry.path for entry, _ in subdirs],
+            }
+            stack.extend((entry.path, rel, rulesets) for entry, rel in reversed(subdirs))
+    
+    def _drop(self, path):
+        """Forget path and every directory below it."""
+        stack = [path]
+        while stack:
+            d = self.dirs.pop(stack.pop(), None)
+            if d is not None:
+                self.seen.discard(d['key'])
+                stack.extend(d['subdirs'])
     
-    return "\n".join(results)
+    def _relist(self, path, d, mtime):
+        """Re-list path after its mtime changed; new subdirectories are walked."""
+        listing = _list_dir(path, d['rel'], d['inherited'], self.exclude, self.gitignore)
+        if listing is None:
+            self._drop(path)
+            return
+        _, files, subdirs = listing
+        d['mtime'] = mtime
+        d['files'] = [Path(entry.path) for entry in files]
+        old = set(d['subdirs'])
+        d['subdirs'] = [entry.path for entry, _ in subdirs]
+        for gone in old.difference(d['subdirs']):
+            self._drop(gone)
+        for entry, rel in subdirs:
+            if entry.path not in self.dirs:
+                self._walk(entry.path, rel, d['rulesets'])
+    
+    def poll(self):
+        """Map every .py file to its (mtime_ns, size), bringing the tree up to date first."""
+        mtimes = {}
+        for path in list(self.dirs):
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                # dropped before anything is walked, so a directory moved
+                # elsewhere in the tree isn't taken for a symlink loop
+                self._drop(path)
+        for path, mtime in mtimes.items():
+            d = self.dirs.get(path)
+            if d is None:  # dropped with a parent in this pass
+                continue
+            if self._ignore_sig(path) != d['ignore']:
+                self._drop(path)
+                self._walk(path, d['rel'], self._root_rules() if path == self.root
+                           else d['inherited'])
+            elif mtime != d['mtime']:
+                self._relist(path, d, mtime)
+        snap = {}
+        limit = self.max_file_size
+        for d in self.dirs.values():
+            for path in d['files']:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if limit is None or st.st_size <= limit:
+                    snap[path] = (st.st_mtime_ns, st.st_size)
+        return snap
 
 
-def revert_aithon(source_code):
-    """Remove #/<line> markers from code."""
-    import re
-    lines = source_code.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        stripped = line.strip()
-        if stripped == '#/' or re.match(r'^#/\d+$', stripped):
+def watch_directory(source_dir, target_dir, process='replica', engine='auto',
+                    interval=0.25, debounce=0.1, callback=print, exclude=(), gitignore=True, max_file_size=None):
+    """Re-mark .py files under source_dir as they change. Runs until interrupted.
+
+    The tree is polled every interval seconds: a poll stats the known
+    files and re-lists only directories whose mtime changed. Changed files
+    are collected until no new change has been seen for debounce seconds
+    (the next poll comes as soon as that time is up), then only those
+    files go through convert_file. Outputs written here are recorded so
+    they don't trigger another round.
+    """
+    input_path = Path(source_dir)
+    tree = _WatchedTree(input_path, exclude, gitignore, max_file_size)
+    snap = tree.poll()
+    pending = set()
+    last_change = 0.0
+    while True:
+        wait = interval
+        if pending:
+            wait = min(wait, max(0.0, last_change + debounce - time.monotonic()))
+        time.sleep(wait)
+        current = tree.poll()
+        changed = {f for f, sig in current.items() if snap.get(f) != sig}
+        snap = current
+        if changed:
+            pending |= changed
+            last_change = time.monotonic()
+            if debounce > 0:
+                continue
+        if not pending or time.monotonic() - last_change < debounce:
             continue
-        if re.match(r'^#/\d*\s*$', line):
+        
+        for py_file in sorted(pending):
+            if py_file not in snap:
+                continue
+            out_file = _target_file(py_file, input_path, target_dir, process)
+            try:
+                if out_file.parent != py_file.parent:
+                    os.makedirs(out_file.parent, exist_ok=True)
+                callback(convert_file(py_file, out_file, engine))
+                st = out_file.stat()
+            except (OSError, ValueError) as e:
+                callback(f"Failed: {py_file}: {e}")
+                continue
+            snap[out_file] = (st.st_mtime_ns, st.st_size)
+        pending.clear()
+
+
+def _strip_markers(source_code):
+    """Drop every line that holds only a #/<line> marker.
+
+    One regex pass over the whole buffer, str or bytes (no decoding:
+    '#/', digits and newlines are the same bytes in every encoding a .py
+    file may use). Sources without '#/' are returned as is.
+    """
+    if isinstance(source_code, str):
+        tag, nl, cr, line_re, only_re = '#/', '\n', '\r', _MARKER_LINE, _MARKER_ONLY
+    else:
+        tag, nl, cr, line_re, only_re = (b'#/', b'\n', b'\r', _MARKER_LINE_BYTES,
+                                         _MARKER_ONLY_BYTES)
+    if tag not in source_code:
+        return source_code
+    if cr in source_code and (_LONE_CR if nl == '\n' else _LONE_CR_BYTES).search(source_code):
+        return _strip_marker_lines(source_code)
+    source_code = line_re.sub(nl[:0], source_code)
+    # a marker on the last line takes the newline before it instead
+    last = source_code.rfind(nl) + 1
+    if only_re.fullmatch(source_code, last):
+        end = max(last - 1, 0)
+        if end and source_code[end - 1:end] == cr:
+            end -= 1
+        source_code = source_code[:end]
+    return source_code
+
+
+def _strip_marker_lines(source_code):
+    """_strip_markers for sources with lone \r line endings, a line at a time.
+
+    The \n-anchored patterns cannot see those lines. Dropping a line must
+    also not leave a \r right before an empty \n line, which would then
+    read as a single \r\n: that empty line ends in \r as well.
+    """
+    if isinstance(source_code, str):
+        newline_re, only_re, cr, lf = _NEWLINE, _MARKER_ONLY, '\r', '\n'
+    else:
+        newline_re, only_re, cr, lf = _NEWLINE_BYTES, _MARKER_ONLY_BYTES, b'\r', b'\n'
+    lines = newline_re.split(source_code)
+    endings = newline_re.findall(source_code) + [lf[:0]]
+    parts = []
+    for line, end in zip(lines, endings):
+        if only_re.fullmatch(line):
+            if not end and parts:
+                # a marker on the last line takes the newline before it instead
+                parts.pop()
             continue
-        cleaned_lines.append(line)
-    return '\n'.join(cleaned_lines)
+        if not line and end == lf and parts and parts[-1] == cr:
+            end = cr
+        parts.append(line)
+        parts.append(end)
+    return lf[:0].join(parts)
+
+
+def revert_aithon(source_code):
+    """Remove #/<line> markers from code (str, or bytes without decoding)."""
+    return _strip_markers(source_code)
+
+
+def _kept_ranges(buf):
+    """(start, end) byte ranges of buf that _strip_markers keeps, in order."""
+    last = buf.rfind(b'\n') + 1
+    pos = 0
+    for match in _MARKER_LINE_BYTES.finditer(buf, 0, last):
+        if match.start() > pos:
+            yield pos, match.start()
+        pos = match.end()
+    if not _MARKER_ONLY_BYTES.fullmatch(buf, last):
+        if len(buf) > pos:
+            yield pos, len(buf)
+        return
+    # a marker on the last line takes the newline before it instead
+    if last > pos:
+        yield pos, last
+    # that newline ends whatever range came last: tell the caller to trim it
+    yield None, None
+
+
+def _stream_revert(input_path, output_path):
+    """revert_file for big inputs: mmap the file and write the kept slices.
+
+    Peak memory stays at one slice (a memoryview, not a copy) whatever
+    the file size. As with _write_output, an output that already holds
+    the result is left alone (another pass over the input, but no write
+    and no new mtime); otherwise it is replaced through a temp file.
+    Returns False, leaving the work to the in-memory path, for files
+    with lone \r line endings.
+    """
+    with open(input_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf.find(b'\r') >= 0 and _LONE_CR_BYTES.search(buf):
+            return False
+        if hasattr(buf, 'madvise'):  # 3.8+, and not on Windows
+            buf.madvise(mmap.MADV_SEQUENTIAL)
+        marked = buf.find(b'#/') >= 0
+        
+        def ranges():
+            return _kept_ranges(buf) if marked else iter([(0, len(buf))])
+        
+        with memoryview(buf) as view:
+            try:
+                st = os.stat(output_path)
+            except FileNotFoundError:
+                st = None
+                os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            if st is not None and _holds_slices(output_path, st.st_size, view, ranges):
+                return True
+            slices = _trimmed_slices(view, ranges())
+            try:
+                _replace_output(output_path, st, slices)
+            finally:
+                slices.close()  # drop the last slice so the mmap can close
+    return True
+
+
+def _holds_slices(path, size, view, ranges):
+    """Whether the file at path (size bytes) holds exactly the slices of view for ranges().
+
+    One pass, compared chunk by chunk against an mmap of the file, that
+    stops at the first difference or as soon as the slices add up to
+    more than size bytes.
+    """
+    step = 1 << 20
+    pos = 0
+    slices = _trimmed_slices(view, ranges())
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else memoryview(b'') as out:
+        try:
+            for piece in slices:
+                for i in range(0, len(piece), step):
+                    with piece[i:i + step] as chunk:
+                        if pos + len(chunk) > size or out[pos:pos + len(chunk)] != chunk:
+                            return False
+                        pos += len(chunk)
+        finally:
+            slices.close()
+    return pos == size
+
+
+def _trimmed_slices(view, ranges):
+    """Slices of view for ranges; a (None, None) entry trims the last newline."""
+    held = None
+    for start, end in ranges:
+        if start is None:
+            if held is not None:
+                end = len(held) - 1
+                if end and held[end] == 10 and held[end - 1] == 13:  # b'\r\n'
+                    end -= 1
+                held = held[:end]
+            break
+        if held is not None:
+            yield held
+        held = view[start:end]
+    if held is not None and len(held):
+        yield held
 
 
 def revert_file(input_path, output_path):
-    """Remove markers from a single file."""
-    with open(input_path, 'r') as f:
-        source = f.read()
-    
-    clean_code = revert_aithon(source)
+    """Remove markers from a single file.
+
+    Works on the raw bytes: nothing is decoded, so the encoding, BOM and
+    line endings come out exactly as they went in. Files over
+    STREAM_THRESHOLD bytes are restored from an mmap in slices, so
+    memory use does not grow with the file.
+    """
+    if output_path and os.path.getsize(input_path) > STREAM_THRESHOLD:
+        if _stream_revert(input_path, output_path):
+            return f"Reverted: {input_path} -> {output_path}"
+    with open(input_path, 'rb') as f:
+        clean = revert_aithon(f.read())
     
     if output_path:
-        output_dir = os.path.dirname(output_path)
-        if output_dir:
-            os.makedirs(output_dir, exist_ok=True)
-        with open(output_path, 'w') as f:
-            f.write(clean_code)
+        _write_output(output_path, clean)
         return f"Reverted: {input_path} -> {output_path}"
     else:
-        print(clean_code)
+        print(_decode_source(clean)[0])
+        return None
+
+
+def revert_stream(infile=None, outfile=None, chunk_size=1 << 16):
+    """Remove markers from infile as it arrives, writing to outfile.
+
+    Both are binary files, stdin and stdout by default. Whatever one read
+    returns (up to chunk_size) is stripped line by line and flushed
+    straight away, so a pipe sees output before its input ends. Only the
+    last newline is held back, in case a marker on the last line claims it.
+    Input with lone \r line endings is read to the end before stripping.
+    """
+    infile = infile or sys.stdin.buffer
+    outfile = outfile or sys.stdout.buffer
+    read = getattr(infile, 'read1', infile.read)
+    carry = held = b''
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        carry += chunk
+        cut = carry.rfind(b'\n') + 1
+        if not cut:
+            continue
+        if b'\r' in carry and _LONE_CR_BYTES.search(carry, 0, cut):
+            # lone \r line endings: the rest goes through _strip_markers in one piece
+            carry += infile.read()
+            break
+        lines, carry = _MARKER_LINE_BYTES.sub(b'', carry[:cut]), carry[cut:]
+        if not lines:
+            continue
+        end = len(lines) - 1
+        if end and lines[end - 1:end] == b'\r':
+            end -= 1
+        outfile.write(held + lines[:end])
+        outfile.flush()
+        held = lines[end:]
+    # the rest may still end in a marker line that claims the held newline
+    outfile.write(_strip_markers(held + carry))
+    outfile.flush()
+
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, mtime_ns INTEGER, engine TEXT
+);
+CREATE TABLE IF NOT EXISTS markers (
+    path TEXT, marker INTEGER, output_line INTEGER, kind TEXT,
+    start INTEGER, end INTEGER, depth INTEGER, qualname TEXT,
+    PRIMARY KEY (path, marker)
+) WITHOUT ROWID;
+"""
+
+
+def _index_job(job):
+    """Worker: analyze one file for the index."""
+    py_file, engine = job
+    result = analyze(_read_source(py_file)[0], engine)
+    entry = _cache_entry(py_file, py_file)
+    # the heuristic marks block starts; their end is unknown
+    heuristic = result.engine == 'heuristic'
+    rows = [(m.line, m.output_line, m.kind, m.start, None if heuristic else m.line,
+             m.depth, m.qualname)
+            for m in result.markers]
+    return entry, result.engine, rows
+
+
+def index_directory(source_dir, db_path=None, engine='auto', jobs=1, exclude=(), gitignore=True, max_file_size=None):
+    """Record every marker of every .py file under source_dir in a SQLite index.
+
+    db_path defaults to INDEX_FILE inside source_dir. Re-runs only
+    re-analyze files whose content changed and drop files that are gone;
+    a new engine fingerprint rebuilds everything.
+    """
+    import sqlite3
+    input_path = Path(source_dir)
+    db_path = db_path or os.path.join(source_dir, INDEX_FILE)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(_INDEX_SCHEMA)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'engine'").fetchone()
+        fingerprint = f"{_engine_fingerprint()}:{engine}"
+        if row is None or row[0] != fingerprint:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM markers")
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('engine', ?)", (fingerprint,))
+        known = {path: {'sha256': sha, 'size': size, 'mtime_ns': mtime}
+                 for path, sha, size, mtime in conn.execute(
+                     "SELECT path, sha256, size, mtime_ns FROM files")}
+        
+        todo = []
+        seen = set()
+        for py_file in walk_py_files(input_path, exclude=exclude, gitignore=gitignore, max_file_size=max_file_size):
+            key = py_file.relative_to(input_path).as_posix()
+            seen.add(key)
+            entry = known.get(key)
+            if entry:
+                mtime_ns = entry['mtime_ns']
+                if _unchanged(entry, py_file):
+                    if entry['mtime_ns'] != mtime_ns:
+                        conn.execute("UPDATE files SET mtime_ns = ? WHERE path = ?",
+                                     (entry['mtime_ns'], key))
+                    continue
+            todo.append((key, py_file))
+        
+        gone = [(key,) for key in known if key not in seen]
+        conn.executemany("DELETE FROM files WHERE path = ?", gone)
+        conn.executemany("DELETE FROM markers WHERE path = ?", gone)
+        
+        results = _map_jobs(_index_job, [(py_file, engine) for _, py_file in todo], jobs)
+        for (key, _), (entry, used, rows) in zip(todo, results):
+            conn.execute("DELETE FROM markers WHERE path = ?", (key,))
+            conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                         (key, entry['sha256'], entry['size'], entry['mtime_ns'], used))
+            conn.executemany("INSERT INTO markers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(key,) + r for r in rows])
+        conn.commit()
+    finally:
+        conn.close()
+    return f"Indexed {len(todo)} files ({len(seen) - len(todo)} unchanged, {len(gone)} removed)"
+
+
+def query_index(db_path, path, marker=None):
+    """Look up markers of path (relative to the indexed directory) without reading it.
+
+    Returns a list of dicts: the one marker asked for, or all of them.
+    """
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        sql = ("SELECT path, marker, output_line, kind, start, end, depth, qualname "
+               "FROM markers WHERE path = ?")
+        params = [Path(path).as_posix()]
+        if marker is not None:
+            sql += " AND marker = ?"
+            params.append(marker)
+        return [dict(row) for row in conn.execute(sql + " ORDER BY marker", params)]
+    finally:
+        conn.close()
+
+
+def _rpc_paths(func, *names, required=()):
+    """Wrap func so the named path arguments must be strings.
+
+    A number would be taken for a file descriptor (1 is the server's own
+    stdout). Arguments in required must also be non-empty: convert_file
+    and revert_file print to the channel without a target.
+    """
+    signature = inspect.signature(func)
+    
+    def call(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs).arguments
+        for name in names:
+            if bound.get(name) is not None and not isinstance(bound[name], str):
+                raise TypeError(f"{name} must be a string")
+        for name in required:
+            if not bound.get(name):
+                raise ValueError(f"{name} required")
+        return func(*args, **kwargs)
+    return call
+
+
+RPC_METHODS = {
+    'convert_aithon': convert_aithon,
+    'revert_aithon': revert_aithon,
+    'convert_file': _rpc_paths(convert_file, 'input_path', 'output_path',
+                               required=('output_path',)),
+    'revert_file': _rpc_paths(revert_file, 'input_path', 'output_path',
+                              required=('output_path',)),
+    'apply_edit': apply_edit,
+    'convert_directory': _rpc_paths(convert_directory, 'source_dir', 'target_dir', 'cache_dir'),
+    'revert_directory': _rpc_paths(revert_directory, 'source_dir', 'target_dir'),
+    'convert_mapping': _rpc_paths(convert_mapping, 'target_dir'),
+    'revert_mapping': _rpc_paths(revert_mapping, 'target_dir'),
+}
+
+
+def _rpc_error(req_id, code, message):
+    return {'jsonrpc': '2.0', 'id': req_id, 'error': {'code': code, 'message': message}}
+
+
+def handle_rpc(line):
+    """Answer one JSON-RPC 2.0 request line. Returns None for notifications."""
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return _rpc_error(None, -32700, f"Parse error: {e}")
+    if not isinstance(request, dict):
+        return _rpc_error(None, -32600, "Invalid Request")
+    req_id = request.get('id')
+    name = request.get('method')
+    method = RPC_METHODS.get(name) if isinstance(name, str) else None
+    params = request.get('params', [])
+    if method is None:
+        response = _rpc_error(req_id, -32601, f"Method not found: {request.get('method')}")
+    elif not isinstance(params, (list, dict)):
+        response = _rpc_error(req_id, -32602, "params must be an array or object")
+    else:
+        try:
+            result = method(**params) if isinstance(params, dict) else method(*params)
+            response = {'jsonrpc': '2.0', 'id': req_id, 'result': result}
+        except TypeError as e:
+            response = _rpc_error(req_id, -32602, f"Invalid params: {e}")
+        except (OSError, ValueError) as e:
+            response = _rpc_error(req_id, -32000, str(e))
+        except Exception as e:
+            # anything else (RecursionError on absurdly deep input, ...) must not
+            # take the server down with it
+            response = _rpc_error(req_id, -32603, f"Internal error: {type(e).__name__}: {e}")
+    return response if 'id' in request else None
+
+
+def serve(infile=None, outfile=None):
+    """Answer newline-delimited JSON-RPC requests until infile is exhausted."""
+    infile = infile or sys.stdin
+    outfile = outfile or sys.stdout
+    for line in infile:
+        if not line.strip():
+            continue
+        response = handle_rpc(line)
+        if response is not None:
+            outfile.write(json.dumps(response) + '\n')
+            outfile.flush()
+
+
+def serve_unix(path):
+    """Serve JSON-RPC on a Unix domain socket, one thread per connection."""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                response = handle_rpc(line)
+                if response is not None:
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+                    self.wfile.flush()
+
+    def remove_socket():
+        """Unlink a (stale) socket at path; refuse to touch anything else."""
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise ValueError(f"{path} exists and is not a socket")
+        os.unlink(path)
+    
+    remove_socket()
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        remove_socket()
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _drain(records, total, message=_message, report=None, interval=0.2):
+    """Consume directory-run records, printing messages and a progress line.
+
+    message(record) gives the line to print for a record (None: nothing);
+    message=None prints nothing at all. The progress line (count, files/sec, ETA) goes to stderr and is only
+    drawn when stderr is a terminal; total is the expected file count
+    (None if unknown: no ETA).
+    Returns the number of records.
+    """
+    live = sys.stderr.isatty()
+    # messages on the same terminal must clear the progress line first
+    clear = live and sys.stdout.isatty()
+    started = last = time.monotonic()
+    done = 0
+    for record in records:
+        done += 1
+        if report is not None:
+            report(record)
+        line = message(record) if message is not None else None
+        if line is not None:
+            if clear:
+                sys.stderr.write('\r\033[K')
+            print(line, flush=clear)
+        now = time.monotonic()
+        if live and now - last >= interval:
+            last = now
+            rate = done / ((now - started) or 1e-9)
+            if total is None:
+                sys.stderr.write(f"\r{done} files  {rate:.1f} files/sec")
+            else:
+                eta = _format_eta(max(total - done, 0) / rate)
+                sys.stderr.write(f"\r{done}/{total} files  {rate:.1f} files/sec  ETA {eta}")
+            sys.stderr.flush()
+    if live:
+        sys.stderr.write('\r\033[K')
+        sys.stderr.flush()
+    return done
+
+
+def _failures(records, failed, ok=('fresh', 'ok')):
+    """Pass check/verify records through, collecting the paths of failing ones into failed."""
+    for record in records:
+        if record['status'] not in ok:
+            failed.append(record['path'])
+        yield record
+
+
+def _verify_message(record):
+    if record['status'] == 'ok':
         return None
+    if record['status'] == 'error':
+        return f"Error: {record['path']}: {record['error']}"
+    if not record['round_trip']:
+        return (f"Mismatch: {record['path']}: line {record['line']}: "
+                f"expected {record['expected']!r}, got {record['actual']!r}")
+    return f"Mismatch: {record['path']}: marked text parses to a different AST"
+
+
+def _stale_message(record):
+    return None if record['status'] == 'fresh' else _message(record)
+
+
+def _pipe(source, target, restore=False, engine='auto', stats=None, report=None):
+    """--source/--target runs where either one is '-' (stdin/stdout).
+
+    Returns the usual message when the output is a file, None otherwise.
+    """
+    if target != '-':
+        data = sys.stdin.buffer.read()
+        if restore:
+            _write_output(target, revert_aithon(data))
+            return f"Reverted: - -> {target}"
+        record = _convert('-', target, engine, stats, data)
+        if report is not None:
+            report(record)
+        return _message(record)
+    infile = None if source == '-' else open(source, 'rb')
+    try:
+        if restore:
+            revert_stream(infile)
+        else:
+            convert_stream(infile, None, engine, stats, report)
+    except BrokenPipeError:
+        # the reader went away (| head); as for any filter, that is not an error
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if infile is not None:
+            infile.close()
+    return None
+
+
+def _changes(parser, args, **kwargs):
+    """iter_changed for the CLI's --since/--staged, turning git failures into usage errors."""
+    try:
+        yield from iter_changed(args.srcdir, args.tgtdir, args.since, args.staged,
+                                engine=args.engine, exclude=args.exclude, **kwargs)
+    except ValueError as e:
+        parser.error(str(e))
 
 
 def main():
@@ -276,48 +2577,260 @@ def main():
         epilog=HELP
     )
     
-    parser.add_argument('--source', help='Input file')
-    parser.add_argument('--target', help='Output file')
+    parser.add_argument('command', nargs='?',
+                        choices=['watch', 'serve', 'index', 'query', 'edit', 'verify', 'batch',
+                                 '-'],
+                        help='watch: keep --srcdir marked as files change; '
+                             'serve: answer JSON-RPC on stdio or --socket; '
+                             'index: record all markers of --srcdir in SQLite; '
+                             'query: look up --marker of --source in the index; '
+                             'edit: replace the block after --marker in --source; '
+                             'verify: round-trip check of --srcdir or --source; '
+                             'batch: answer JSON Lines requests from --source or stdin; '
+                             '-: stdin to stdout, like --source - --target -')
+    parser.add_argument('--source', help="Input file ('-' for stdin)")
+    parser.add_argument('--target', help="Output file ('-' for stdout, the default for --source -)")
     parser.add_argument('--srcdir', help='Input directory')
     parser.add_argument('--tgtdir', help='Output directory')
     parser.add_argument('--action', default='replica', choices=['replica', 'replace', 'restore'],
                         help='replica (create _ai files), replace (overwrite existing files), or restore (remove markers)')
     parser.add_argument('--dryrun', action='store_true',
                         help='Show what would be converted')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Worker processes for directory runs (default: CPU count)')
+    parser.add_argument('--engine', default='auto', choices=ENGINES,
+                        help='Block finder: ast, tokenize (streaming, for huge files), or auto')
+    parser.add_argument('--cache', action='store_true',
+                        help='Skip unchanged files using a manifest in --tgtdir')
+    parser.add_argument('--cache-dir',
+                        help='Like --cache, but keep the manifest in this directory')
+    parser.add_argument('--socket',
+                        help='serve: listen on this Unix domain socket instead of stdio')
+    parser.add_argument('--db',
+                        help=f'index/query: SQLite index path (default: <srcdir>/{INDEX_FILE})')
+    parser.add_argument('--marker', type=int,
+                        help='query: marker number (default: all markers of --source); '
+                             'edit: marker whose block is replaced')
+    parser.add_argument('--replacement',
+                        help="edit: file with the new block ('-' for stdin)")
+    parser.add_argument('--stats', type=int, nargs='?', const=10, metavar='N',
+                        help='Print per-phase timings and the N slowest files (default 10) to stderr')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help='Skip files and directories matching GLOB (name or relative path); repeatable')
+    parser.add_argument('--no-gitignore', action='store_true',
+                        help='Do not prune paths listed in .gitignore files')
+    parser.add_argument('--max-file-size', type=int, metavar='BYTES',
+                        help='Skip .py files larger than BYTES')
+    parser.add_argument('--since', metavar='REF',
+                        help='Directory runs: only .py files changed since git REF (plus untracked)')
+    parser.add_argument('--staged', action='store_true',
+                        help='Directory runs: only .py files with staged changes, read from the git index')
+    parser.add_argument('--check', action='store_true',
+                        help='Only verify that the targets are up to date; list stale ones, '
+                             'exit 1 if any, write nothing')
+    parser.add_argument('--report', metavar='PATH',
+                        help="Write one JSON record per converted file to PATH "
+                             "(JSON array; JSON Lines for *.jsonl or '-' = stdout)")
     
     args = parser.parse_args()
+    if args.command == '-':
+        if args.source or args.srcdir:
+            parser.error("'aithon -' reads stdin; drop --source/--srcdir")
+        args.command, args.source = None, '-'
+    if not args.command and args.source == '-' and not args.target:
+        args.target = '-'
+    pipe = not args.command and '-' in (args.source, args.target)
+    if pipe and (args.check or args.dryrun):
+        parser.error("--check and --dryrun need files, not stdin/stdout")
+    if pipe and args.target == '-' and args.report == '-':
+        parser.error("--report - and --target - both write to stdout")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    # the library functions default to one job; the CLI to one per CPU
+    jobs = args.jobs or os.cpu_count() or 1
+    stats = Stats(args.stats) if args.stats is not None else None
+    if stats is not None and (args.command or args.action == 'restore'):
+        parser.error("--stats applies to conversions")
+    if args.report and (args.command not in (None, 'verify') or args.action == 'restore'
+                        or args.dryrun):
+        parser.error("--report applies to conversions and verify")
+    report = _ReportWriter(args.report) if args.report else None
+    # with the report on stdout, the usual messages would corrupt it
+    echo = args.report != '-'
+    walk = dict(exclude=args.exclude, gitignore=not args.no_gitignore,
+                max_file_size=args.max_file_size)
+    if args.check and (args.command or args.action == 'restore' or args.dryrun
+                       or args.since or args.staged or args.cache or args.cache_dir):
+        parser.error("--check applies to plain --source/--srcdir conversions")
+    changed = args.since or args.staged
+    if changed:
+        if args.command or not args.srcdir or args.dryrun or args.cache or args.cache_dir:
+            parser.error("--since/--staged apply to --srcdir conversions and restores "
+                         "without --dryrun or --cache")
+        if args.since and args.staged:
+            parser.error("use either --since or --staged")
+        if args.staged and args.action == 'replace':
+            parser.error("--staged cannot be combined with --action replace")
     
-    if args.action == 'restore':
+    if args.command == 'watch':
+        if not args.srcdir or not args.tgtdir:
+            parser.error("watch requires --srcdir and --tgtdir")
+        if args.action == 'restore':
+            parser.error("watch supports --action replica or replace")
+        process = 'inplace' if args.action == 'replace' else 'replica'
+        print(f"Watching {args.srcdir} (Ctrl-C to stop)")
+        try:
+            watch_directory(args.srcdir, args.tgtdir, process, args.engine, **walk)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'index':
+        if not args.srcdir:
+            parser.error("index requires --srcdir")
+        print(index_directory(args.srcdir, args.db, args.engine, jobs, **walk))
+    elif args.command == 'query':
+        if not args.source:
+            parser.error("query requires --source")
+        db_path = args.db or os.path.join(args.srcdir or '.', INDEX_FILE)
+        if not os.path.exists(db_path):
+            parser.error(f"no index at {db_path}; run aithon index first")
+        for row in query_index(db_path, args.source, args.marker):
+            print(json.dumps(row))
+    elif args.command == 'edit':
+        if not args.source or args.marker is None or not args.replacement:
+            parser.error("edit requires --source, --marker and --replacement")
+        # bytes, decoded like a source file, not with the locale's encoding
+        try:
+            if args.replacement == '-':
+                data = sys.stdin.buffer.read()
+            else:
+                with open(args.replacement, 'rb') as f:
+                    data = f.read()
+        except OSError as e:
+            parser.error(f"can't read --replacement: {e}")
+        replacement = _decode_source(data)[0]
+        try:
+            print(edit_file(args.source, args.marker, replacement, args.target, args.engine))
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.command == 'verify':
+        if args.srcdir:
+            total = sum(1 for _ in walk_py_files(args.srcdir, **walk)) if sys.stderr.isatty() else 0
+            records = iter_verify(args.srcdir, jobs, args.engine, ordered=True, **walk)
+        elif args.source:
+            total = 1
+            records = [verify_file(args.source, args.engine)]
+        else:
+            parser.error("verify requires --srcdir or --source")
+        failed = []
+        count = _drain(_failures(records, failed), total, _verify_message if echo else None, report)
+        if echo:
+            print(f"Verified {count} files: {len(failed)} failed")
+        if report is not None:
+            report.close()
+        if failed:
+            sys.exit(1)
+    elif args.command == 'batch':
+        infile = sys.stdin if args.source in (None, '-') else open(args.source)
+        outfile = sys.stdout if args.target in (None, '-') else open(args.target, 'w')
+        errors = 0
+        try:
+            for response in iter_batch(infile, jobs, args.engine):
+                errors += 'error' in response
+                outfile.write(json.dumps(response) + '\n')
+                outfile.flush()
+        except BrokenPipeError:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        finally:
+            for f in (infile, outfile):
+                if f not in (sys.stdin, sys.stdout):
+                    f.close()
+        if errors:
+            print(f"{errors} requests failed", file=sys.stderr)
+            sys.exit(1)
+    elif args.command == 'serve':
+        try:
+            if args.socket:
+                serve_unix(args.socket)
+            else:
+                serve()
+        except KeyboardInterrupt:
+            pass
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.action == 'restore':
         # Remove markers
         if args.source:
             if not args.target:
                 parser.error("--target required")
-            print(revert_file(args.source, args.target))
+            if pipe:
+                message = _pipe(args.source, args.target, restore=True)
+                if message:
+                    print(message)
+            else:
+                print(revert_file(args.source, args.target))
         elif args.srcdir:
             if not args.tgtdir:
                 parser.error("--tgtdir required")
-            input_path = Path(args.srcdir)
-            output_path = Path(args.tgtdir)
-            py_files = list(input_path.rglob("*.py"))
-            for py_file in py_files:
-                rel_path = py_file.relative_to(input_path)
-                out_file = output_path / rel_path.name
-                out_file.parent.mkdir(parents=True, exist_ok=True)
-                revert_file(py_file, out_file)
-            print(f"Restored {len(py_files)} files")
+            if changed:
+                count = _drain(_changes(parser, args, restore=True), None, None)
+            else:
+                total = sum(1 for _ in walk_py_files(args.srcdir, **walk)) if sys.stderr.isatty() else 0
+                count = _drain(iter_revert(args.srcdir, args.tgtdir, jobs, **walk), total,
+                               None)
+            print(f"Restored {count} files")
         else:
             parser.print_help()
     elif args.srcdir:
         if not args.tgtdir:
             parser.error("--tgtdir required")
         process = 'inplace' if args.action == 'replace' else 'replica'
-        print(convert_directory(args.srcdir, args.tgtdir, args.dryrun, process))
+        cache_dir = args.cache_dir or (args.tgtdir if args.cache else None)
+        if args.dryrun:
+            print(convert_directory(args.srcdir, args.tgtdir, True, process, **walk))
+        elif args.check:
+            total = sum(1 for _ in walk_py_files(args.srcdir, **walk)) if sys.stderr.isatty() else 0
+            checked = iter_check(args.srcdir, args.tgtdir, process, jobs, args.engine,
+                                 ordered=True, **walk)
+            stale = []
+            count = _drain(_failures(checked, stale), total, _stale_message if echo else None, report)
+            if echo:
+                print(f"{len(stale)} of {count} files stale")
+            if stale:
+                sys.exit(1)
+        elif changed:
+            records = _changes(parser, args, process=process, stats=stats)
+            if not _drain(records, None, _message if echo else None, report):
+                print(f"No changed .py files in {args.srcdir}")
+        else:
+            total = sum(1 for _ in walk_py_files(args.srcdir, **walk)) if sys.stderr.isatty() else 0
+            records = iter_convert(args.srcdir, args.tgtdir, process, jobs, cache_dir,
+                                   args.engine, stats, ordered=True, **walk)
+            if not _drain(records, total, _message if echo else None, report):
+                print(f"No .py files found in {args.srcdir}")
     elif args.source:
         if not args.target:
             parser.error("--target required")
-        convert_file(args.source, args.target)
+        if args.check:
+            record = check_file(args.source, args.target, args.engine)
+            if report is not None:
+                report(record)
+                report.close()
+            if record['status'] != 'fresh':
+                if echo:
+                    print(_message(record))
+                sys.exit(1)
+            return
+        if pipe:
+            _pipe(args.source, args.target, engine=args.engine, stats=stats, report=report)
+        else:
+            convert_file(args.source, args.target, args.engine, stats, report)
     else:
         parser.print_help()
+    
+    if report is not None:
+        report.close()
+    if stats is not None:
+        print(stats.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Regression gate: mark the installed CPython stdlib and compare with a baseline.
+
+    python benchmarks/bench_stdlib.py [--stdlib DIR] [--baseline FILE]
+                                      [--tolerance F] [--update-baseline]
+
+Every .py file under the stdlib (site-packages excluded) goes through
+analyze() once, in this process. Reports files/sec, MB/sec, peak RSS and
+how many files fell back to the heuristic collector, then compares them
+with the baseline JSON. Exits nonzero when throughput drops or peak RSS
+grows by more than --tolerance (a fraction, default 0.25). Heuristic
+counts are compared only when the baseline came from the same Python
+version. --update-baseline rewrites the baseline instead of checking.
+Throughput is machine-dependent: refresh the baseline when the
+reference machine changes.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import sysconfig
+import time
+import tokenize
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aithon.aithon import analyze  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / 'stdlib_baseline.json'
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / (1 << 10)
+
+
+def stdlib_files(stdlib):
+    for path in sorted(Path(stdlib).rglob('*.py')):
+        if 'site-packages' not in path.parts and 'dist-packages' not in path.parts:
+            yield path
+
+
+def run(stdlib):
+    files = nbytes = unreadable = 0
+    heuristic = []
+    elapsed = 0.0
+    for path in stdlib_files(stdlib):
+        try:
+            with tokenize.open(path) as f:
+                source = f.read()
+        except (SyntaxError, UnicodeDecodeError):
+            # bad coding cookies in the test suite's own fixtures
+            unreadable += 1
+            continue
+        start = time.perf_counter()
+        result = analyze(source)
+        elapsed += time.perf_counter() - start
+        files += 1
+        nbytes += len(source.encode('utf-8', 'surrogatepass'))
+        if result.engine == 'heuristic':
+            heuristic.append(str(path.relative_to(stdlib)))
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'files': files,
+        'unreadable': unreadable,
+        'megabytes': round(nbytes / 1e6, 3),
+        'seconds': round(elapsed, 3),
+        'files_per_sec': round(files / elapsed, 1),
+        'mb_per_sec': round(nbytes / 1e6 / elapsed, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'heuristic_fallbacks': len(heuristic),
+        'heuristic_files': heuristic,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Return a list of regressions of current against baseline."""
+    failures = []
+    for key in ('files_per_sec', 'mb_per_sec'):
+        floor = baseline[key] * (1 - tolerance)
+        if current[key] < floor:
+            failures.append(f"{key} {current[key]} < {floor:.3f} (baseline {baseline[key]})")
+    ceiling = baseline['peak_rss_mb'] * (1 + tolerance)
+    if current['peak_rss_mb'] > ceiling:
+        failures.append(f"peak_rss_mb {current['peak_rss_mb']} > {ceiling:.1f} "
+                        f"(baseline {baseline['peak_rss_mb']})")
+    if current['python'] == baseline['python']:
+        if current['heuristic_fallbacks'] > baseline['heuristic_fallbacks']:
+            new = sorted(set(current['heuristic_files']) - set(baseline['heuristic_files']))
+            failures.append(f"heuristic_fallbacks {current['heuristic_fallbacks']} > "
+                            f"{baseline['heuristic_fallbacks']}: {', '.join(new)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stdlib', default=sysconfig.get_paths()['stdlib'])
+    parser.add_argument('--baseline', default=str(BASELINE))
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    current = run(args.stdlib)
+    summary = {k: v for k, v in current.items() if k != 'heuristic_files'}
+    print(json.dumps(summary, indent=2))
+
+    if args.update_baseline:
+        Path(args.baseline).write_text(json.dumps(current, indent=2) + '\n')
+        print(f"Baseline written: {args.baseline}", file=sys.stderr)
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    if current['python'] != baseline['python']:
+        print(f"Baseline is from Python {baseline['python']}; "
+              f"heuristic counts not compared", file=sys.stderr)
+    failures = compare(current, baseline, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Time convert/revert on a seeded synthetic corpus and write JSON results.
+
+    python benchmarks/bench_suite.py [--seed N] [--scale F] [--repeat N]
+                                     [--jobs N] [--output results.json]
+                                     [--corpus DIR]
+
+The corpus covers deeply nested blocks, a 100k-line module, many tiny
+files, long try/except/finally chains and broken-indentation variants
+that force the heuristic collector. convert_aithon, revert_aithon,
+convert_file and convert_directory are timed separately (best of
+--repeat). --scale shrinks or grows every case; --corpus keeps the
+generated files in DIR instead of a temporary directory.
+"""
+
+import argparse
+import ast
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aithon.aithon import (  # noqa: E402
+    analyze, convert_aithon, convert_directory, convert_file, revert_aithon,
+)
+
+
+NAMES = ('alpha', 'beta', 'gamma', 'delta', 'items', 'total', 'value', 'node', 'key', 'row')
+
+
+def _stmt(rng, indent):
+    pad = '    ' * indent
+    a, b = rng.sample(NAMES, 2)
+    return rng.choice((
+        f"{pad}{a} = {b} + {rng.randint(0, 999)}",
+        f"{pad}{a}.append({b})",
+        f"{pad}{a} = [{b} for {b} in range({rng.randint(1, 50)})]",
+        f"{pad}print({a!r}, {b})",
+        f"{pad}{a} = {{'{b}': {rng.randint(0, 9)}, 'n': None}}",
+    ))
+
+
+def gen_function(rng, name, indent=0):
+    pad = '    ' * indent
+    lines = [f"{pad}def {name}({', '.join(rng.sample(NAMES, 2))}):"]
+    for _ in range(rng.randint(1, 4)):
+        lines.append(_stmt(rng, indent + 1))
+    kind = rng.randrange(4)
+    if kind == 0:
+        lines += [f"{pad}    if {rng.choice(NAMES)}:", _stmt(rng, indent + 2),
+                  f"{pad}    elif {rng.choice(NAMES)} is None:", _stmt(rng, indent + 2),
+                  f"{pad}    else:", _stmt(rng, indent + 2)]
+    elif kind == 1:
+        lines += [f"{pad}    for {rng.choice(NAMES)} in range(10):", _stmt(rng, indent + 2),
+                  _stmt(rng, indent + 2)]
+    elif kind == 2:
+        lines += [f"{pad}    with open({rng.choice(NAMES)}) as f:", _stmt(rng, indent + 2)]
+    lines.append(f"{pad}    return {rng.choice(NAMES)}")
+    return lines
+
+
+def gen_module(rng, n_lines):
+    """Top-level functions and classes until n_lines is reached."""
+    lines = ['import os', 'import sys', '']
+    i = 0
+    while len(lines) < n_lines:
+        i += 1
+        if rng.random() < 0.2:
+            lines.append(f"class C{i}:")
+            lines.append(f"    attr = {i}")
+            for j in range(rng.randint(1, 4)):
+                lines.append('')
+                lines += gen_function(rng, f"m{j}", 1)
+        else:
+            lines += gen_function(rng, f"f{i}")
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def gen_deep(rng, depth, copies):
+    """if/while/def nesting `depth` levels deep, repeated `copies` times."""
+    out = []
+    for c in range(copies):
+        for d in range(depth):
+            pad = '    ' * d
+            # for/while/try/with count toward CPython's 20 static blocks
+            head = 'while' if d % 10 == 5 else rng.choice(('if', 'if', 'def'))
+            if head == 'def':
+                out.append(f"{pad}def f{c}_{d}():")
+            else:
+                out.append(f"{pad}{head} {rng.choice(NAMES)}:")
+            out.append(_stmt(rng, d + 1))
+        out.append(_stmt(rng, depth))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def gen_try_chains(rng, chains, handlers):
+    out = []
+    for c in range(chains):
+        out.append(f"def guarded{c}():")
+        out.append("    try:")
+        out.append(_stmt(rng, 2))
+        for h in range(handlers):
+            out.append(f"    except E{h} as exc:")
+            out.append(_stmt(rng, 2))
+        out.append("    else:")
+        out.append(_stmt(rng, 2))
+        out.append("    finally:")
+        out.append(_stmt(rng, 2))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def gen_broken(rng, n_lines):
+    """A module with stray indentation so ast.parse fails.
+
+    A stray indent can land on a blank line or still parse (e.g. a tab
+    in front of a body line), so lines are mutated until it really fails.
+    """
+    lines = gen_module(rng, n_lines).split('\n')
+    mutations = max(1, n_lines // 200)
+    while True:
+        for _ in range(mutations):
+            i = rng.randrange(len(lines))
+            if lines[i].strip():
+                lines[i] = ('  ' if rng.random() < 0.5 else '\t') + lines[i]
+        text = '\n'.join(lines)
+        try:
+            ast.parse(text)
+        except SyntaxError:
+            return text
+        mutations = 1
+
+
+def generate_corpus(root, seed=0, scale=1.0):
+    """Write the corpus under root and return {case: [files]}."""
+    rng = random.Random(seed)
+    root = Path(root)
+    n = lambda x: max(1, int(x * scale))  # noqa: E731
+
+    cases = {}
+
+    def write(case, rel, text):
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+        cases.setdefault(case, []).append(path)
+
+    write('deep_nesting', 'deep_nesting.py', gen_deep(rng, 90, n(200)))
+    write('large_module', 'large_module.py', gen_module(rng, n(100_000)))
+    for i in range(n(2000)):
+        write('tiny_files', f'tiny/pkg{i % 20}/mod{i}.py', gen_module(rng, rng.randint(3, 12)))
+    write('try_chains', 'try_chains.py', gen_try_chains(rng, n(500), 30))
+    for i in range(n(5)):
+        write('broken_indent', f'broken/broken{i}.py', gen_broken(rng, n(5000)))
+    return cases
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(cases, root, repeat, jobs):
+    results = []
+    scratch = Path(tempfile.mkdtemp(prefix='aithon-bench-out-'))
+    try:
+        for case, files in cases.items():
+            sources = [f.read_text() for f in files]
+            marked = [convert_aithon(s) for s in sources]
+            engines = sorted({analyze(s).engine for s in sources})
+            outs = [scratch / f"{case}_{i}_ai.py" for i in range(len(files))]
+            record = {
+                'case': case,
+                'files': len(files),
+                'bytes': sum(len(s) for s in sources),
+                'lines': sum(s.count('\n') for s in sources),
+                'engines': engines,
+            }
+            record['convert_aithon'] = best_of(lambda: [convert_aithon(s) for s in sources], repeat)
+            record['revert_aithon'] = best_of(lambda: [revert_aithon(m) for m in marked], repeat)
+
+            def convert_files():
+                # an output already holding the result is skipped, not written
+                for o in outs:
+                    if o.exists():
+                        o.unlink()
+                for f, o in zip(files, outs):
+                    convert_file(str(f), str(o))
+
+            record['convert_file'] = best_of(convert_files, repeat)
+            results.append(record)
+            print(f"{case}: {record['files']} files, {record['lines']} lines, "
+                  f"engine {'/'.join(engines)}, convert {record['convert_aithon'] * 1e3:.1f} ms, "
+                  f"revert {record['revert_aithon'] * 1e3:.1f} ms, "
+                  f"file {record['convert_file'] * 1e3:.1f} ms", file=sys.stderr)
+
+        target = scratch / 'tree'
+
+        def whole_tree():
+            shutil.rmtree(target, ignore_errors=True)
+            convert_directory(str(root), str(target), jobs=jobs)
+
+        seconds = best_of(whole_tree, repeat)
+        results.append({
+            'case': 'convert_directory',
+            'files': sum(len(f) for f in cases.values()),
+            'jobs': jobs,
+            'convert_directory': seconds,
+        })
+        print(f"convert_directory: {seconds * 1e3:.1f} ms (jobs={jobs})", file=sys.stderr)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here (default: stdout)')
+    parser.add_argument('--corpus', help='generate the corpus into this directory and keep it')
+    args = parser.parse_args()
+
+    root = Path(args.corpus) if args.corpus else Path(tempfile.mkdtemp(prefix='aithon-bench-'))
+    try:
+        cases = generate_corpus(root, args.seed, args.scale)
+        results = run(cases, root, args.repeat, args.jobs)
+    finally:
+        if not args.corpus:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+    else:
+        print(text)
+    # the broken variants exist to exercise the heuristic; fail if they stop doing so
+    broken = next(r for r in results if r['case'] == 'broken_indent')
+    return 0 if broken['engines'] == ['heuristic'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Benchmark get_terminators_ast against the old ast.walk + hasattr collector.
+
+    python benchmarks/bench_terminators.py [--repeat N] [files ...]
+
+Defaults to the bundled example.py. Exits nonzero if the outputs differ.
+"""
+
+import argparse
+import ast
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aithon.aithon import get_terminators_ast  # noqa: E402
+
+
+def walk_terminators(tree, source_lines):
+    """The previous collector: every node, every block field probed."""
+    block_markers = {}
+
+    def process_node(node):
+        if hasattr(node, 'lineno') and hasattr(node, 'end_lineno'):
+            if node.lineno == node.end_lineno:
+                return
+        if hasattr(node, 'body') and node.body:
+            last_stmt = node.body[-1]
+            if hasattr(last_stmt, 'end_lineno'):
+                block_markers[last_stmt.end_lineno] = last_stmt.end_lineno
+        if hasattr(node, 'handlers') and node.handlers:
+            for handler in node.handlers:
+                if handler.body and handler.body[-1]:
+                    if hasattr(handler.body[-1], 'end_lineno'):
+                        block_markers[handler.body[-1].end_lineno] = handler.body[-1].end_lineno
+        if hasattr(node, 'orelse') and node.orelse:
+            if node.orelse[-1] and hasattr(node.orelse[-1], 'end_lineno'):
+                block_markers[node.orelse[-1].end_lineno] = node.orelse[-1].end_lineno
+        if hasattr(node, 'finalbody') and node.finalbody:
+            if node.finalbody[-1] and hasattr(node.finalbody[-1], 'end_lineno'):
+                block_markers[node.finalbody[-1].end_lineno] = node.finalbody[-1].end_lineno
+
+    for node in ast.walk(tree):
+        process_node(node)
+    return block_markers
+
+
+def best_of(func, tree, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(tree, None)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='*',
+                        default=[str(Path(__file__).resolve().parent.parent / 'aithon' / 'example.py')])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.files:
+        tree = ast.parse(Path(path).read_text())
+        try:
+            expected = walk_terminators(tree, None)
+        except TypeError:
+            # multi-line lambda / conditional expression: .body is not a list
+            print(f"{path}: walk collector raises TypeError, skipped")
+            continue
+        if expected != get_terminators_ast(tree, None):
+            print(f"MISMATCH: {path}")
+            failed = True
+            continue
+        old = best_of(walk_terminators, tree, args.repeat)
+        new = best_of(get_terminators_ast, tree, args.repeat)
+        print(f"{path}: walk {old * 1e3:.3f} ms, statements {new * 1e3:.3f} ms, "
+              f"{old / new:.1f}x faster")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+"""edit_file keeps the file's encoding and refuses what it can't hold.
+
+    python -m pytest tests/
+"""
+
+import pytest
+
+from aithon.aithon import convert_file, edit_file
+
+
+def marked_latin1(tmp_path):
+    source = tmp_path / 'l1.py'
+    source.write_bytes(b'# -*- coding: latin-1 -*-\ndef f():\n    return 1\n')
+    target = tmp_path / 'l1_ai.py'
+    convert_file(source, target)
+    return target
+
+
+def test_replacement_is_written_in_the_file_encoding(tmp_path):
+    target = marked_latin1(tmp_path)
+    edit_file(target, 3, '    return "\xe9"\n')
+    assert b'"\xe9"' in target.read_bytes()
+
+
+def test_unencodable_replacement_is_a_value_error(tmp_path):
+    target = marked_latin1(tmp_path)
+    before = target.read_bytes()
+    with pytest.raises(ValueError, match='latin-1|iso-8859-1'):
+        edit_file(target, 3, '    return "€"\n')
+    assert target.read_bytes() == before
@@ -0,0 +1,114 @@
+"""The tokenize engine must find the same block ends as the ast engine.
+
+    python -m pytest tests/
+"""
+
+import ast
+import sys
+from pathlib import Path
+
+import pytest
+
+from aithon.aithon import _ast_blocks, _tokenize_blocks, analyze
+
+PACKAGE = Path(__file__).resolve().parent.parent / 'aithon'
+
+TRICKY = {
+    'match_as_name': (
+        "match = 1\n"
+        "match.x = 2\n"
+        "def f(match):\n"
+        "    match = match + 1\n"
+        "    return match\n"
+    ),
+    'lambda_in_headers': (
+        "if (lambda x: x)(1):\n"
+        "    y = 1\n"
+        "for f in [lambda: 1,\n"
+        "          lambda: 2]:\n"
+        "    f()\n"
+        "while (lambda: False)():\n"
+        "    pass\n"
+    ),
+    'one_line_compounds': (
+        "if x: y = 1\n"
+        "elif z: y = 2\n"
+        "else: y = 3\n"
+        "while x: x -= 1\n"
+        "for i in x: pass\n"
+        "with open(x) as f: pass\n"
+        "class C: pass\n"
+        "def f(): return 1\n"
+        "try: a()\n"
+        "except E: b()\n"
+        "else: c()\n"
+        "finally: d()\n"
+    ),
+    'one_line_then_block': (
+        "def f(x):\n"
+        "    if x: return 1\n"
+        "    for i in x:\n"
+        "        if i: continue\n"
+        "    return 0\n"
+    ),
+}
+if sys.version_info >= (3, 10):
+    TRICKY['match_statement'] = (
+        "def f(p):\n"
+        "    match p:\n"
+        "        case 1:\n"
+        "            return 1\n"
+        "        case {'k': v} if v:\n"
+        "            return v\n"
+        "        case _:\n"
+        "            pass\n"
+        "    return 0\n"
+    )
+    TRICKY['case_pattern_spanning_lines'] = (
+        "match p:\n"
+        "    case (\n"
+        "        1\n"
+        "    ):\n"
+        "        x = 1\n"
+        "    # a comment before the next case\n"
+        "\n"
+        "    case (2 |\n"
+        "          3):\n"
+        "        x = 2\n"
+    )
+if sys.version_info >= (3, 11):
+    TRICKY['except_star'] = (
+        "try:\n"
+        "    f()\n"
+        "except* ValueError:\n"
+        "    g()\n"
+        "except* TypeError as e:\n"
+        "    h(e)\n"
+    )
+
+
+@pytest.mark.parametrize('name', sorted(TRICKY))
+def test_tricky_constructs(name):
+    source = TRICKY[name]
+    assert _tokenize_blocks(source) == _ast_blocks(ast.parse(source), source.split('\n'))
+
+
+def test_example_py():
+    source = (PACKAGE / 'example.py').read_text()
+    assert _tokenize_blocks(source) == _ast_blocks(ast.parse(source), source.split('\n'))
+
+
+def test_complex_py_falls_back_under_both_engines():
+    # complex.py is broken on purpose: both engines must reject it
+    source = (PACKAGE / 'complex.py').read_text()
+    by_ast = analyze(source, 'ast')
+    by_tokenize = analyze(source, 'tokenize')
+    assert by_ast.engine == by_tokenize.engine == 'heuristic'
+    assert by_ast.text == by_tokenize.text
+
+
+def test_tokenize_only_checks_block_structure():
+    # the documented difference: an error inside a block is not a tokenize error
+    source = 'def f():\n    print "x"\n    return 1\n'
+    assert analyze(source, 'ast').engine == 'heuristic'
+    assert analyze(source, 'tokenize').engine == 'tokenize'
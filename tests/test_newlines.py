@@ -0,0 +1,91 @@
+"""Encodings and line endings must survive convert -> restore byte for byte.
+
+    python -m pytest tests/
+"""
+
+import io
+
+import pytest
+
+import aithon.aithon as aithon
+from aithon.aithon import _stream_revert, convert_file, revert_file, revert_stream
+
+BODY = 'def f(x):\n    if x:\n        y = 1\n    return 2\n\nclass C:\n    pass\n'
+
+FILES = {
+    'lf': BODY.encode(),
+    'crlf': BODY.replace('\n', '\r\n').encode(),
+    'lone_cr': BODY.replace('\n', '\r').encode(),
+    'mixed': b'def f(x):\r\n    if x:\n        y = 1\r    return 2\r\n\nclass C:\r    pass\n',
+    # a lone \r right before an empty \n line must not turn into \r\n
+    'cr_then_empty_lf': b'if x:\r    y = 1\r\nz = 2\r\n\nif z:\r    pass\r',
+    'no_final_newline': b'def f():\r\n    return 1',
+    'bom': b'\xef\xbb\xbf' + BODY.replace('\n', '\r\n').encode(),
+    'latin1_cookie': (b'# -*- coding: latin-1 -*-\r\n'
+                      b'def f():\r\n    return "caf\xe9"\r\n'),
+    'invalid_utf8': b'def f():\n    s = "\xff\xfe"\n    return s\n',
+    'already_marked': b'def f():\r\n    pass\r\n#/2\r\n',
+}
+
+
+@pytest.fixture(params=sorted(FILES))
+def case(request, tmp_path):
+    """(original bytes, expected restore, converted path) for each sample file."""
+    data = FILES[request.param]
+    source = tmp_path / 'source.py'
+    source.write_bytes(data)
+    marked = tmp_path / 'marked_ai.py'
+    convert_file(source, marked)
+    return data, aithon.revert_aithon(data), marked
+
+
+def test_convert_adds_markers_in_the_file_own_style(case):
+    data, _, marked = case
+    out = marked.read_bytes()
+    assert b'#/' in out
+    if b'\r' not in data:
+        assert b'\r' not in out
+    elif b'\n' not in data:
+        assert b'\n' not in out
+    elif data.count(b'\n') == data.count(b'\r\n'):
+        assert out.count(b'\n') == out.count(b'\r\n')
+    assert out.startswith(b'\xef\xbb\xbf') == data.startswith(b'\xef\xbb\xbf')
+
+
+def test_revert_file(case, tmp_path):
+    data, expected, marked = case
+    out = tmp_path / 'restored.py'
+    revert_file(marked, out)
+    assert out.read_bytes() == expected
+    if b'#/' not in data:
+        assert expected == data
+
+
+def test_revert_file_streaming(case, tmp_path, monkeypatch):
+    _, expected, marked = case
+    monkeypatch.setattr(aithon, 'STREAM_THRESHOLD', 0)
+    out = tmp_path / 'restored.py'
+    revert_file(marked, out)
+    assert out.read_bytes() == expected
+
+
+def test_stream_revert(case, tmp_path):
+    data, expected, marked = case
+    out = tmp_path / 'restored.py'
+    if _stream_revert(marked, out):
+        assert out.read_bytes() == expected
+        # a second run finds the output identical and leaves it alone
+        mtime = out.stat().st_mtime_ns
+        assert _stream_revert(marked, out)
+        assert out.stat().st_mtime_ns == mtime
+    else:
+        # only lone \r files are left to the in-memory path
+        assert b'\r' in data and not out.exists()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 16])
+def test_revert_stream(case, chunk_size):
+    _, expected, marked = case
+    out = io.BytesIO()
+    revert_stream(io.BytesIO(marked.read_bytes()), out, chunk_size)
+    assert out.getvalue() == expected
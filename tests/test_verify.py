@@ -0,0 +1,28 @@
+"""verify must compare the round trip against the original source.
+
+    python -m pytest tests/
+"""
+
+from aithon.aithon import verify_file, verify_source
+
+
+def test_plain_source_is_ok():
+    record = verify_source('def f():\n    return 1\n')
+    assert record['status'] == 'ok'
+    assert record['round_trip'] and record['ast']
+
+
+def test_marker_line_inside_string_is_a_mismatch(tmp_path):
+    source = 'DOC = """\nusage:\n#/1\n"""\n'
+    assert verify_source(source)['status'] == 'mismatch'
+    path = tmp_path / 's.py'
+    path.write_bytes(source.encode())
+    record = verify_file(path)
+    assert record['status'] == 'mismatch'
+    assert record['line'] == 3
+
+
+def test_old_markers_are_a_mismatch():
+    record = verify_source('def f():\n    pass\n#/2\n')
+    assert record['status'] == 'mismatch'
+    assert record['ast'] is True